@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+
+class StateNotifier:
+    '''Wake asyncio coroutines when any of a set of SlotBuffers publishes a new sample.
+
+    The buffers' writer threads (DDS listeners or ingestion workers) never touch the event loop
+    directly: the first publish after the loop has consumed a notification schedules a single
+    ``call_soon_threadsafe`` that sets an ``asyncio.Event``, so a burst of samples costs one
+    wake-up. Buffers written by another process (shared memory) have no in-process listener;
+    their ``seq`` is polled from the loop every ``poll_interval`` seconds instead.
+
+    The notifier binds to the running loop on first use. Consumers ``clear()`` before reading
+    state and ``await wait()`` for the next sample, or iterate ``updates(max_rate)``.
+    '''
+    def __init__(self, *buffers, poll_interval = 0.002):
+        self.buffers = buffers
+        self.poll_interval = poll_interval
+        self.notified = 0  # wake-ups delivered to the loop
+        self._loop = None
+        self._event = None
+        self._scheduled = False
+        self._poller = None
+        self._polled = [buffer for buffer in buffers if buffer.shm is not None]
+        for buffer in buffers:
+            if buffer.shm is None:
+                buffer.listeners.append(self._on_publish)
+
+    def _bind(self):
+        if self._loop is None:
+            self._event = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+            if self._polled:
+                self._poller = asyncio.ensure_future(self._poll())
+
+    def _on_publish(self, buffer, slot):
+        # runs on the writer thread
+        loop = self._loop
+        if loop is None or self._scheduled:
+            return
+        self._scheduled = True
+        try:
+            loop.call_soon_threadsafe(self._set)
+        except RuntimeError:
+            pass  # loop closed during shutdown
+
+    def _set(self):
+        self._scheduled = False
+        self.notified += 1
+        self._event.set()
+
+    async def _poll(self):
+        seqs = [buffer.seq for buffer in self._polled]
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for i, buffer in enumerate(self._polled):
+                seq = buffer.seq
+                if seq != seqs[i]:
+                    seqs[i] = seq
+                    self.notified += 1
+                    self._event.set()
+
+    def clear(self):
+        '''Mark the current state as consumed; call right before reading it.'''
+        self._bind()
+        self._event.clear()
+
+    async def wait(self, timeout = None):
+        '''Wait until a sample newer than the last ``clear()`` is published. Returns False on timeout.'''
+        self._bind()
+        if self._event.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def updates(self, max_rate = None):
+        '''Yield once per fresh state, coalescing samples so consecutive yields are at least ``1 / max_rate`` apart.'''
+        min_interval = 0.0 if max_rate is None else 1.0 / max_rate
+        last = None
+        while True:
+            await self.wait()
+            if last is not None:
+                remaining = last + min_interval - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+            self.clear()
+            last = time.monotonic()
+            yield last
+
+    def close(self):
+        '''Detach from the buffers and stop polling.'''
+        for buffer in self.buffers:
+            if self._on_publish in buffer.listeners:
+                buffer.listeners.remove(self._on_publish)
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+
+def check_wakeups(wakeups = 500, period = 0.002, max_median_latency = 2e-3):
+    '''Await samples published from a writer thread every ``period`` seconds; return a list of failures (empty when fine).
+
+    The notifier must never wake the loop more often than samples are published, and the median
+    delay from a sample to the coroutine's wake-up must stay below ``max_median_latency`` seconds.'''
+    import threading
+    from buffers import HandStateBuffer
+
+    class _Msg:
+        def __init__(self, n):
+            self.states = [type("State", (), {"q": 0.0})() for _ in range(n)]
+
+    buffer = HandStateBuffer(12)
+    notifier = StateNotifier(buffer)
+
+    def writer(stop):
+        msg = _Msg(12)
+        while not stop.is_set():
+            buffer.write(msg)
+            time.sleep(period)
+
+    async def consume():
+        latencies = []
+        stop = threading.Event()
+        notifier.clear()
+        thread = threading.Thread(target=writer, args=(stop,), daemon=True)
+        thread.start()
+        async for now in notifier.updates():
+            latencies.append(now - buffer.stamp[buffer.latest_slot()])
+            if len(latencies) == wakeups:
+                break
+        stop.set()
+        thread.join()
+        return latencies
+
+    latencies = sorted(asyncio.run(consume()))
+    median = latencies[len(latencies) // 2]
+    print(f"{len(latencies)} wake-ups ({notifier.notified} notifications) for {buffer.seq} samples, "
+          f"latency median {median * 1e3:.3f} ms, max {latencies[-1] * 1e3:.3f} ms")
+    failures = []
+    if notifier.notified > buffer.seq:
+        failures.append(f"{notifier.notified} notifications for {buffer.seq} samples")
+    if median > max_median_latency:
+        failures.append(f"median wake-up latency {median * 1e3:.3f} ms above {max_median_latency * 1e3:.3f} ms")
+    return failures
+
+
+if __name__ == "__main__":
+    # Wake-ups of a coroutine awaiting samples published from a writer thread at 500 Hz; exit 1 on failure.
+    import sys
+
+    failures = check_wakeups()
+    for failure in failures:
+        print(f"StateNotifier: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
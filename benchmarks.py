@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+import numpy as np
+import pinocchio
+
+from unitree_sdk2py.idl.default import unitree_hg_msg_dds__LowState_, unitree_go_msg_dds__MotorState_
+from unitree_sdk2py.idl.unitree_go.msg.dds_ import MotorStates_
+
+import robot_control
+import robot_hand_inspire
+import utils
+from robot_control import G1_29_ArmController, G1_29_JointIndex, URDF_JOINT_MAP as ARM_URDF_JOINT_MAP
+from robot_hand_inspire import Inspire_Controller_DFX
+from scheduler import PeriodicScheduler
+from scene_stream import SceneBroadcaster, _SessionState
+from async_bridge import StateNotifier
+
+URDF_PATH = "g1.urdf"
+
+
+class LoopbackBus:
+    '''In-process stand-in for DDS: publishers hand samples straight to the subscribers of the same topic.'''
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+
+    def publisher(self, topic, msg_type):
+        bus = self
+
+        class LoopbackPublisher:
+            def Init(self):
+                pass
+
+            def Write(self, msg, timeout = None):
+                for subscriber in bus.subscribers[topic]:
+                    subscriber.deliver(msg)
+                return True
+
+        return LoopbackPublisher()
+
+    def subscriber(self, topic, msg_type):
+        bus = self
+
+        class LoopbackSubscriber:
+            def __init__(self):
+                self.handler = None
+                self.latest = None
+
+            def Init(self, handler = None, queueLen = 0):
+                self.handler = handler
+                bus.subscribers[topic].append(self)
+
+            def deliver(self, msg):
+                if self.handler is not None:
+                    self.handler(msg)
+                else:
+                    self.latest = msg
+
+            def Read(self, timeout = None):
+                msg, self.latest = self.latest, None
+                return msg
+
+        return LoopbackSubscriber()
+
+
+class TimedUplinkQueue(deque):
+    '''Session uplink queue that stamps every send (``perf_counter_ns``) and signals it to another thread.'''
+    def __init__(self):
+        super().__init__()
+        self.sent_at = 0
+        self.sent = threading.Event()
+
+    def append(self, item):
+        self.sent_at = time.perf_counter_ns()
+        super().append(item)
+        self.sent.set()
+
+    def extend(self, items):
+        self.sent_at = time.perf_counter_ns()
+        super().extend(items)
+        self.sent.set()
+
+
+@contextlib.contextmanager
+def loopback_dds(bus):
+    '''Route the controllers' ChannelPublisher / ChannelSubscriber through ``bus`` while the context is active.'''
+    saved = []
+    for module in (robot_control, robot_hand_inspire):
+        saved.append((module, module.ChannelPublisher, module.ChannelSubscriber))
+        module.ChannelPublisher = bus.publisher
+        module.ChannelSubscriber = bus.subscriber
+    try:
+        yield bus
+    finally:
+        for module, publisher, subscriber in saved:
+            module.ChannelPublisher = publisher
+            module.ChannelSubscriber = subscriber
+
+
+def synthetic_lowstate(tick):
+    msg = unitree_hg_msg_dds__LowState_()
+    msg.tick = tick
+    for i, motor in enumerate(msg.motor_state):
+        motor.q = 0.3 * np.sin(0.01 * tick + i)
+        motor.dq = 0.3 * np.cos(0.01 * tick + i)
+    return msg
+
+
+def synthetic_hand_state(tick):
+    msg = MotorStates_(states=[unitree_go_msg_dds__MotorState_() for _ in range(12)])
+    for i, state in enumerate(msg.states):
+        state.q = 0.8 + 0.5 * np.sin(0.01 * tick + i)
+    return msg
+
+
+def measure(fn, repeat = 2000, warmup = 100):
+    '''Return per-call wall time statistics of ``fn()`` in microseconds.'''
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    clock = time.perf_counter_ns
+    for i in range(repeat):
+        start = clock()
+        fn()
+        samples[i] = clock() - start
+    return statistics(samples)
+
+
+def measure_latency(fn, repeat = 2000, warmup = 100):
+    '''Return statistics, in microseconds, of the latencies in nanoseconds returned by ``fn()``.'''
+    for _ in range(warmup):
+        fn()
+    return statistics(np.array([fn() for _ in range(repeat)], dtype=np.float64))
+
+
+def statistics(samples):
+    '''Return the count, mean and percentiles in microseconds of ``samples`` given in nanoseconds.'''
+    samples = samples / 1e3
+    return {
+        "n": len(samples),
+        "mean_us": float(samples.mean()),
+        "p50_us": float(np.percentile(samples, 50)),
+        "p90_us": float(np.percentile(samples, 90)),
+        "p99_us": float(np.percentile(samples, 99)),
+    }
+
+
+def run_benchmarks(repeat):
+    results = {}
+    bus = LoopbackBus()
+    with loopback_dds(bus):
+        lowstate_pub = bus.publisher(robot_control.kTopicLowState, None)
+        hand_pub = bus.publisher(robot_hand_inspire.kTopicInspireDFXState, None)
+        lowstate_msgs = [synthetic_lowstate(tick) for tick in range(64)]
+        hand_msgs = [synthetic_hand_state(tick) for tick in range(64)]
+
+        # keep the constructor's subscribe wait satisfied
+        stop = threading.Event()
+        def feed():
+            tick = 0
+            while not stop.is_set():
+                lowstate_pub.Write(lowstate_msgs[tick % 64])
+                hand_pub.Write(hand_msgs[tick % 64])
+                tick += 1
+                time.sleep(0.01)
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        # a very long period parks the background publish thread; cycles are driven below
+        arm = G1_29_ArmController(simulation_mode = True, event_driven = True, state_queue_depth = 0,
+                                  ctrl_scheduler = PeriodicScheduler(3600.0), instrument = False)
+        hand = Inspire_Controller_DFX(event_driven = True, state_queue_depth = 0, instrument = False)
+        stop.set()
+        feeder.join()
+
+        counter = iter(range(1 << 62))
+        results["lowstate_ingest"] = measure(lambda: lowstate_pub.Write(lowstate_msgs[next(counter) % 64]), repeat)
+        results["get_motor_states"] = measure(arm.get_motor_states, repeat)
+        results["get_current_dual_arm_q"] = measure(arm.get_current_dual_arm_q, repeat)
+        results["inspire_get_state"] = measure(hand.get_state, repeat)
+        results["inspire_get_state_array"] = measure(hand.get_state_array, repeat)
+
+        model = pinocchio.buildModelFromUrdf(URDF_PATH, mimic = True)
+        state = {**arm.get_motor_states(), **hand.get_state()}
+        q = utils.set_q_from_joint_dict(model, pinocchio.neutral(model), state)
+        results["set_q_from_joint_dict"] = measure(lambda: utils.set_q_from_joint_dict(model, pinocchio.neutral(model), state), repeat)
+        results["all_joint_positions"] = measure(lambda: utils.all_joint_positions(model, q), repeat)
+        arm_joint_names = [ARM_URDF_JOINT_MAP.get(id.name) for id in G1_29_JointIndex]
+        mapper = utils.JointMapper(model, [arm_joint_names, hand.state_names])
+        hand_q = np.zeros(len(hand.state_names))
+        results["joint_mapper"] = measure(lambda: mapper(arm.get_current_motor_q(view = True), hand.get_state_array(hand_q)), repeat)
+
+        arm_q_target, arm_tauff_target = np.full(14, 0.1), np.zeros(14)
+        def ctrl_cycle():
+            arm_q_target[:] += 1e-4  # force the arm entries to change every cycle
+            arm.ctrl_dual_arm(arm_q_target, arm_tauff_target)
+            arm._ctrl_step(time.monotonic())
+        results["ctrl_cycle"] = measure(ctrl_cycle, repeat)
+
+        # producer side alone: lowstate sample written, then one broadcaster tick on this thread
+        app = SimpleNamespace(ws = {0: None})
+        sess = SimpleNamespace(CURRENT_WS_ID = 0, uplink_queue = deque())
+        broadcaster = SceneBroadcaster(app, max_pending = 1 << 30)
+        broadcaster.add_urdf("robot", "g1.urdf", [0.0, 0.0, 0.0],
+                             lambda: mapper(arm.get_current_motor_q(view = True), hand.get_state_array(hand_q)), mapper.names,
+                             epsilon = 0.0)
+        broadcaster.sessions.append(_SessionState(sess))
+        broadcaster.tick()
+        def write_and_tick():
+            lowstate_pub.Write(lowstate_msgs[next(counter) % 64])
+            broadcaster.tick()
+            sess.uplink_queue.clear()
+        results["broadcaster_tick"] = measure(write_and_tick, repeat)
+
+        # end to end: LowStateBuffer.write -> StateNotifier wake-up of the event loop (another
+        # thread) -> broadcaster tick -> Urdf update bytes queued for a connected viewer. Samples
+        # are spaced beyond the stream's min period so the rate limit does not add to the latency.
+        notifier = StateNotifier(arm.lowstate_buffer)
+        broadcaster = SceneBroadcaster(app, max_pending = 1 << 30, notifier = notifier)
+        broadcaster.add_urdf("robot", "g1.urdf", [0.0, 0.0, 0.0],
+                             lambda: mapper(arm.get_current_motor_q(view = True), hand.get_state_array(hand_q)), mapper.names,
+                             epsilon = 0.0, max_rate = 1e4)
+        uplink = TimedUplinkQueue()
+        broadcaster.sessions.append(_SessionState(SimpleNamespace(CURRENT_WS_ID = 0, uplink_queue = uplink)))
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_until_complete, args=(broadcaster.run(),), daemon=True)
+        loop_thread.start()
+        uplink.sent.wait(5.0)  # first keyframe; the notifier is bound to the loop from then on
+        def end_to_end():
+            time.sleep(0.002)
+            uplink.clear()
+            uplink.sent.clear()
+            start = time.perf_counter_ns()
+            lowstate_pub.Write(lowstate_msgs[next(counter) % 64])
+            if not uplink.sent.wait(1.0):
+                raise RuntimeError("no Urdf update sent for a lowstate sample")
+            return uplink.sent_at - start
+        results["lowstate_to_urdf_update"] = measure_latency(end_to_end, repeat)
+        broadcaster.sessions.clear()
+        loop_thread.join()
+        loop.close()
+        notifier.close()
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''Return the benchmarks whose median regressed by more than ``tolerance`` against ``baseline``,
+    and the baseline benchmarks missing from ``results``.'''
+    regressions = []
+    missing = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            missing.append(name)
+            continue
+        ratio = current["p50_us"] / max(base["p50_us"], 1e-9)
+        if ratio > 1.0 + tolerance:
+            regressions.append((name, base["p50_us"], current["p50_us"], ratio))
+    return regressions, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the state->visualization and command->publish hot paths.")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p50 regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat)
+    text = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions, missing = compare(results, json.load(f), args.tolerance)
+        for name, base, current, ratio in regressions:
+            print(f"REGRESSION {name}: p50 {base:.2f} us -> {current:.2f} us ({ratio:.2f}x)", file=sys.stderr)
+        for name in missing:
+            print(f"MISSING {name}: in the baseline but not measured", file=sys.stderr)
+        if regressions or missing:
+            sys.exit(1)
@@ -0,0 +1,304 @@
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+_RATE_SMOOTHING = 0.05  # weight of the newest inter-arrival interval in the rate estimate
+
+
+class StaleStateError(RuntimeError):
+    '''The latest sample is older than the maximum age the consumer accepts (or none was received).'''
+
+
+class SlotBuffer:
+    '''Preallocated seqlock store with one writer and any number of readers.
+
+    Subclasses declare their per-slot fields in ``_fields``. Samples are written round-robin
+    into ``num_slots`` slots and published by bumping ``seq`` (no lock on either side). The
+    latest sample lives in slot ``seq % num_slots``; a view into it stays intact until
+    ``num_slots - 1`` further samples have been written. Use ``read`` with an ``out`` buffer
+    when a longer-lived consistent copy is needed.
+
+    All fields and the counter live in one block of memory, which is either private or a
+    named ``multiprocessing.shared_memory`` segment (``shm_name``), so a writer in another
+    process can publish into the same arrays the readers index.
+
+    Every field set has a ``stamp`` (``time.monotonic()`` at arrival). From it the buffer keeps
+    the receive age of the latest sample and a smoothed input rate; subclasses may declare
+    extra integer counters in ``_counters`` (kept in the same memory). ``stats`` returns them
+    all, ``check_age`` raises ``StaleStateError`` when the latest sample is too old.
+    '''
+    def __init__(self, num_slots = 3, shm_name = None, create = False):
+        assert num_slots >= 2, f"{type(self).__name__} needs at least two slots"
+        self.num_slots = num_slots
+        self.listeners = []  # called as listener(buffer, slot) after each publish by an in-process writer
+
+        layout = [("_counter", (1,), np.int64), ("_interval", (1,), np.float64),
+                  ("_stats", (max(len(self._counters()), 1),), np.int64)]
+        layout += [(name, (num_slots, *shape), dtype) for name, shape, dtype in self._fields()]
+        offsets, size = [], 0
+        for name, shape, dtype in layout:
+            dtype = np.dtype(dtype)
+            size = -(-size // dtype.alignment) * dtype.alignment
+            offsets.append(size)
+            size += int(np.prod(shape)) * dtype.itemsize
+
+        self.shm = None
+        if shm_name is None and not create:
+            memory = np.zeros(size, dtype=np.uint8)
+        else:
+            self.shm = shared_memory.SharedMemory(name=shm_name, create=create, size=size if create else 0)
+            memory = self.shm.buf
+        for (name, shape, dtype), offset in zip(layout, offsets):
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=memory, offset=offset))
+        if create:
+            self._counter[0] = 0
+
+    def _fields(self):
+        '''Return ``(name, per-slot shape, dtype)`` for every stored field.'''
+        raise NotImplementedError
+
+    def _counters(self):
+        '''Return the names of the stream counters kept by the writer (indices into ``_stats``).'''
+        return []
+
+    @property
+    def seq(self):
+        '''Number of published samples, 0 means nothing received yet.'''
+        return int(self._counter[0])
+
+    def latest_slot(self):
+        '''Return the slot index holding the most recently published sample.'''
+        return int(self._counter[0]) % self.num_slots
+
+    def _next_slot(self):
+        return (int(self._counter[0]) + 1) % self.num_slots
+
+    def _publish(self):
+        seq = int(self._counter[0])
+        if seq:
+            interval = self.stamp[(seq + 1) % self.num_slots] - self.stamp[seq % self.num_slots]
+            last = self._interval[0]
+            self._interval[0] = interval if last == 0.0 else last + _RATE_SMOOTHING * (interval - last)
+        self._counter[0] += 1
+        if self.listeners:
+            slot = self.latest_slot()
+            for listener in self.listeners:
+                listener(self, slot)
+
+    def age(self, now = None):
+        '''Seconds since the latest sample arrived (inf before the first one).'''
+        if self.seq == 0:
+            return float("inf")
+        now = time.monotonic() if now is None else now
+        return now - float(self.stamp[self.latest_slot()])
+
+    @property
+    def rate(self):
+        '''Smoothed input rate in Hz (0.0 until two samples arrived).'''
+        interval = float(self._interval[0])
+        return 1.0 / interval if interval > 0.0 else 0.0
+
+    def check_age(self, max_age, now = None):
+        '''Raise StaleStateError if the latest sample is older than ``max_age`` seconds; returns its age.'''
+        age = self.age(now)
+        if age > max_age:
+            raise StaleStateError(f"{type(self).__name__}: latest sample is {age:.3f} s old (max {max_age:.3f} s)")
+        return age
+
+    def stats(self, now = None):
+        '''Return the sample count, latest age, input rate and the subclass counters as a dict.'''
+        stats = {"received": self.seq, "age": self.age(now), "rate": self.rate}
+        stats.update(zip(self._counters(), self._stats.tolist()))
+        return stats
+
+    def views(self, field, index = slice(None)):
+        '''Return one read-only view of ``field[slot, index]`` per slot, to be indexed by ``latest_slot()``.'''
+        array = getattr(self, field)
+        views = []
+        for slot in range(self.num_slots):
+            view = array[slot][index]
+            view.flags.writeable = False
+            views.append(view)
+        return tuple(views)
+
+    def read(self, field, out, index = slice(None)):
+        '''Copy ``field[latest, index]`` into ``out``, retrying if the writer lapped the reader. Returns the seq read.'''
+        array = getattr(self, field)
+        while True:
+            seq = self.seq
+            np.copyto(out, array[seq % self.num_slots][index])
+            if self.seq - seq < self.num_slots - 1:
+                return seq
+
+    def close(self, unlink = False):
+        '''Release a shared-memory backing (the creator should also unlink it).'''
+        if self.shm is not None:
+            if unlink:
+                self.shm.unlink()
+            self.shm.close()
+
+
+class LowStateBuffer(SlotBuffer):
+    '''Seqlock store for unitree_hg LowState_ samples: q/dq/tau/temperature per motor, tick, mode machine and arrival time.
+
+    The message tick is checked on every write. A sample repeating the latest tick, CRC and
+    motor q is a re-delivery: it is counted in ``repeats`` and not published, so the latest
+    sample's age keeps growing. Publishers that leave tick and CRC at 0 (simulators, bridges)
+    are never de-duplicated, and ``dedup = False`` turns the check off altogether. A forward
+    jump larger than the usual tick step counts one ``tick_gaps`` event and its ``missed``
+    samples; a backward jump counts a ``resets`` (robot restarted).
+    '''
+    def __init__(self, num_motors, num_slots = 3, shm_name = None, create = False, dedup = True):
+        self.num_motors = num_motors
+        self.dedup = dedup
+        super().__init__(num_slots, shm_name, create)
+
+    def _counters(self):
+        return ["tick_gaps", "missed", "repeats", "resets", "tick_step"]
+
+    def _fields(self):
+        return [
+            ("q", (self.num_motors,), np.float64),
+            ("dq", (self.num_motors,), np.float64),
+            ("tau", (self.num_motors,), np.float64),
+            ("temperature", (self.num_motors, 2), np.int16),
+            ("tick", (), np.uint32),
+            ("crc", (), np.uint32),
+            ("mode_machine", (), np.uint8),
+            ("stamp", (), np.float64),  # time.monotonic() at arrival
+        ]
+
+    def write(self, msg):
+        '''Copy a LowState_ message into the next free slot and publish it (re-deliveries are only counted).'''
+        slot = self._next_slot()
+        motor_state = msg.motor_state[:self.num_motors]
+        self.q[slot] = [m.q for m in motor_state]
+        if self.seq and not self._account_tick(msg.tick, msg.crc, slot):
+            return
+        self.dq[slot] = [m.dq for m in motor_state]
+        self.tau[slot] = [m.tau_est for m in motor_state]
+        self.temperature[slot] = [m.temperature for m in motor_state]
+        self.tick[slot] = msg.tick
+        self.crc[slot] = msg.crc
+        self.mode_machine[slot] = msg.mode_machine
+        self.stamp[slot] = time.monotonic()
+        self._publish()
+
+    def _account_tick(self, tick, crc, slot):
+        '''Update the tick counters for a new sample (q already in ``slot``); returns False for a re-delivery.'''
+        latest = self.latest_slot()
+        stats = self._stats  # tick_gaps, missed, repeats, resets, tick_step
+        delta = (int(tick) - int(self.tick[latest])) & 0xFFFFFFFF
+        if delta == 0:
+            if (self.dedup and (tick or crc) and int(crc) == int(self.crc[latest])
+                    and np.array_equal(self.q[slot], self.q[latest])):
+                stats[2] += 1
+                return False
+            return True
+        if delta >= 1 << 31:
+            stats[3] += 1
+            return True
+        step = int(stats[4])
+        if step == 0 or delta < step:
+            stats[4] = step = delta
+        if delta > step:
+            stats[0] += 1
+            stats[1] += delta // step - 1
+        return True
+
+
+class HandStateBuffer(SlotBuffer):
+    '''Seqlock store for the q of a MotorStates_ hand message (both hands, in message order) and its arrival time.'''
+    def __init__(self, num_motors, num_slots = 3, shm_name = None, create = False):
+        self.num_motors = num_motors
+        super().__init__(num_slots, shm_name, create)
+
+    def _fields(self):
+        return [
+            ("q", (self.num_motors,), np.float64),
+            ("stamp", (), np.float64),  # time.monotonic() at arrival
+        ]
+
+    def write(self, msg):
+        '''Copy the first ``num_motors`` state q values of a MotorStates_ message and publish them.'''
+        slot = self._next_slot()
+        self.q[slot] = [s.q for s in msg.states[:self.num_motors]]
+        self.stamp[slot] = time.monotonic()
+        self._publish()
+
+
+# sequences of inspire_hand_state, in IDL order (rows of InspireStateBuffer.state)
+INSPIRE_STATE_FIELDS = ("pos_act", "angle_act", "force_act", "current", "err", "status", "temperature")
+
+
+class InspireStateBuffer(SlotBuffer):
+    '''Seqlock store for every sequence of one hand's inspire_hand_state message and its arrival time.
+
+    The seven sequences (int16 and uint8, which fits int16) share one ``(7, num_motors)`` int16
+    field per slot, rows in ``INSPIRE_STATE_FIELDS`` order, so a message is decoded with a single
+    NumPy assignment; ``row(name)`` gives the row index of a sequence.
+    '''
+    def __init__(self, num_motors, num_slots = 3, shm_name = None, create = False):
+        self.num_motors = num_motors
+        super().__init__(num_slots, shm_name, create)
+
+    def _fields(self):
+        return [
+            ("state", (len(INSPIRE_STATE_FIELDS), self.num_motors), np.int16),
+            ("stamp", (), np.float64),  # time.monotonic() at arrival
+        ]
+
+    @staticmethod
+    def row(name):
+        return INSPIRE_STATE_FIELDS.index(name)
+
+    def write(self, msg):
+        '''Copy all sequences of an inspire_hand_state message and publish them.'''
+        slot = self._next_slot()
+        self.state[slot] = (msg.pos_act, msg.angle_act, msg.force_act, msg.current, msg.err, msg.status, msg.temperature)
+        self.stamp[slot] = time.monotonic()
+        self._publish()
+
+
+class CommandSlot(SlotBuffer):
+    '''Triple-buffered arm command (q and feedforward tau) handed from producer threads to the publish loop.
+
+    ``write`` copies the caller's arrays into the next free slot and publishes it, so a caller
+    may reuse or mutate its arrays right after the call. Writers serialise among themselves on
+    a writer-only lock; the reader never takes it. ``snapshot`` copies the latest command into
+    preallocated arrays without blocking, retrying only if it was lapped by the writers.
+    Every command is stamped with ``time.monotonic()`` so the reader can tell how old it is.
+    '''
+    def __init__(self, size, num_slots = 3):
+        self.size = size
+        super().__init__(num_slots)
+        self._write_lock = threading.Lock()
+
+    def _fields(self):
+        return [
+            ("q", (self.size,), np.float64),
+            ("tau", (self.size,), np.float64),
+            ("stamp", (), np.float64),  # time.monotonic() when written
+        ]
+
+    def write(self, q, tau = None):
+        '''Publish a new command; ``tau = None`` keeps the previous feedforward torque.'''
+        with self._write_lock:
+            slot = self._next_slot()
+            latest = self.latest_slot()
+            self.q[slot] = q
+            self.tau[slot] = self.tau[latest] if tau is None else tau
+            self.stamp[slot] = time.monotonic()
+            self._publish()
+
+    def snapshot(self, q_out, tau_out):
+        '''Copy the latest command into ``q_out`` and ``tau_out``; returns its stamp (0.0 if never written).'''
+        while True:
+            seq = self.seq
+            slot = seq % self.num_slots
+            np.copyto(q_out, self.q[slot])
+            np.copyto(tau_out, self.tau[slot])
+            stamp = float(self.stamp[slot])
+            if self.seq - seq < self.num_slots - 1:
+                return stamp
@@ -0,0 +1,147 @@
+// Client side of scene_stream.JointCodec: turns the compact JOINT_SCHEMA / JOINT_STATE events
+// into UPDATE events of Urdf jointValues that the Vuer client already applies.
+//
+// Register `handleJointEvent` for the JOINT_SCHEMA and JOINT_STATE etypes in a custom Vuer client
+// build, call `frameJointUpdate(performance.now())` once per rendered frame and pass every UPDATE
+// either returns to the client's regular UPDATE handler. The server side is
+// SceneBroadcaster(app, wire_format="float32" | "int16").
+//
+// Updates carrying a capture time ("t") are rendered `interpolation.delay` ms in the past, so
+// the pose is interpolated between two received states: cubic Hermite when velocities ("dv")
+// were sent, linear otherwise. When the next state is late the pose is extrapolated from the
+// last one with its velocities for at most `interpolation.maxExtrapolation` ms, then eased back
+// onto the last received state over the same time and held there (unchanged joints are not
+// re-sent, so holding an extrapolated pose could show a stopped robot in the wrong place).
+// Untimed updates are applied as they arrive.
+
+export const interpolation = {
+  delay: 100,             // ms behind the newest state; about 1.5 send periods at 15 Hz
+  maxExtrapolation: 100,  // ms of extrapolation past the newest state before easing back to it
+  history: 8,             // received states kept per Urdf
+};
+
+const schemas = {};  // Urdf key -> {names, dtype, index_dtype, scale, velocity_scale, values, velocities, samples}
+
+// server monotonic time (ms) + offset = local performance.now() time of the capture; the smallest
+// observed receive delay, relaxed slowly so a drifting clock or a route change is followed
+let clockOffset = null;
+const OFFSET_RELAX = 0.05;  // ms per received update
+
+const ARRAYS = { "<f4": Float32Array, "<i2": Int16Array, "|u1": Uint8Array, "<u2": Uint16Array };
+
+function typedView(bytes, dtype) {
+  const Type = ARRAYS[dtype];
+  // msgpack bin fields arrive as Uint8Array views that may not be aligned: copy into a fresh buffer
+  const copy = bytes.slice();
+  return new Type(copy.buffer, copy.byteOffset, copy.byteLength / Type.BYTES_PER_ELEMENT);
+}
+
+function localTime(t, now) {
+  const serverMs = t / 1000;  // "t" is in microseconds
+  const delay = now - serverMs;
+  clockOffset = clockOffset === null ? delay : Math.min(clockOffset + OFFSET_RELAX, delay);
+  return serverMs + clockOffset;
+}
+
+function applyEntry(schema, entry) {
+  const raw = typedView(entry.v, schema.dtype);
+  const indices = entry.i ? typedView(entry.i, schema.index_dtype) : null;
+  const rawVelocities = entry.dv ? typedView(entry.dv, schema.dtype) : null;
+  if (rawVelocities) {
+    // joints left out of a partial update did not move noticeably since the last one
+    if (indices) schema.velocities.fill(0);
+  }
+  for (let k = 0; k < raw.length; k++) {
+    const j = indices ? indices[k] : k;
+    schema.values[j] = raw[k] * schema.scale;
+    if (rawVelocities) schema.velocities[j] = rawVelocities[k] * schema.velocity_scale;
+  }
+  return rawVelocities !== null;
+}
+
+function jointValuesOf(schema, values) {
+  const jointValues = {};
+  for (let j = 0; j < values.length; j++) jointValues[schema.names[j]] = values[j];
+  return jointValues;
+}
+
+export function handleJointEvent(event, now = performance.now()) {
+  if (event.etype === "JOINT_SCHEMA") {
+    for (const [key, schema] of Object.entries(event.data)) {
+      const n = schema.names.length;
+      schemas[key] = {
+        velocity_scale: 1.0, ...schema,
+        values: new Float64Array(n), velocities: new Float64Array(n), samples: [],
+      };
+    }
+    return null;
+  }
+  if (event.etype !== "JOINT_STATE") return null;
+
+  const elements = [];
+  for (const [key, entry] of Object.entries(event.data)) {
+    const schema = schemas[key];
+    if (!schema) continue;  // schema not received yet, the next keyframe resynchronises
+    const hasVelocities = applyEntry(schema, entry);
+    if (entry.t === undefined) {
+      schema.samples.length = 0;
+      elements.push({ tag: "Urdf", key, jointValues: jointValuesOf(schema, schema.values) });
+      continue;
+    }
+    const t = localTime(Number(entry.t), now);
+    const samples = schema.samples;
+    if (samples.length && t <= samples[samples.length - 1].t) continue;  // re-delivered or out of order
+    samples.push({
+      t,
+      values: Float64Array.from(schema.values),
+      velocities: hasVelocities ? Float64Array.from(schema.velocities) : null,
+    });
+    if (samples.length > interpolation.history) samples.shift();
+  }
+  return elements.length ? { etype: "UPDATE", ts: event.ts, data: elements } : null;
+}
+
+function hermite(a, b, t, out) {
+  const h = b.t - a.t;
+  const s = (t - a.t) / h;
+  if (!a.velocities || !b.velocities) {
+    for (let j = 0; j < out.length; j++) out[j] = a.values[j] + (b.values[j] - a.values[j]) * s;
+    return;
+  }
+  const s2 = s * s, s3 = s2 * s;
+  const h00 = 2 * s3 - 3 * s2 + 1, h10 = s3 - 2 * s2 + s, h01 = -2 * s3 + 3 * s2, h11 = s3 - s2;
+  const hs = h / 1000;  // velocities are per second, times in ms
+  for (let j = 0; j < out.length; j++) {
+    out[j] = h00 * a.values[j] + h10 * hs * a.velocities[j] + h01 * b.values[j] + h11 * hs * b.velocities[j];
+  }
+}
+
+// Return the UPDATE to render at local time `now` (performance.now()), or null when nothing is timed.
+export function frameJointUpdate(now = performance.now()) {
+  const target = now - interpolation.delay;
+  const elements = [];
+  for (const [key, schema] of Object.entries(schemas)) {
+    const samples = schema.samples;
+    if (!samples.length) continue;
+    const out = schema.rendered || (schema.rendered = new Float64Array(schema.values.length));
+    const last = samples[samples.length - 1];
+    if (target <= samples[0].t) {
+      out.set(samples[0].values);
+    } else if (target >= last.t) {
+      out.set(last.values);
+      if (last.velocities) {
+        // v * dt up to maxExtrapolation, then linearly back to zero over another maxExtrapolation
+        const limit = interpolation.maxExtrapolation;
+        const late = target - last.t;
+        const dt = (late <= limit ? late : Math.max(0, 2 * limit - late)) / 1000;
+        for (let j = 0; j < out.length; j++) out[j] += last.velocities[j] * dt;
+      }
+    } else {
+      let i = samples.length - 2;
+      while (samples[i].t > target) i--;
+      hermite(samples[i], samples[i + 1], target, out);
+    }
+    elements.push({ tag: "Urdf", key, jointValues: jointValuesOf(schema, out) });
+  }
+  return elements.length ? { etype: "UPDATE", ts: Date.now(), data: elements } : null;
+}
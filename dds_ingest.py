@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+
+class SampleIngestor:
+    '''Event-driven delivery of DDS samples from a ChannelSubscriber to a handler.
+
+    The subscriber is initialised with a DDS listener, so nothing runs until a sample arrives.
+    With ``queue_depth == 0`` the handler is called directly on the DDS listener thread.
+    Otherwise samples go through a bounded queue to a dedicated worker thread; with
+    ``latest_only`` the worker drains the queue and only handles the newest sample.
+    '''
+    def __init__(self, subscriber, handler, queue_depth = 1, latest_only = True, name = None):
+        self.subscriber = subscriber
+        self.handler = handler
+        self.queue_depth = queue_depth
+        self.latest_only = latest_only
+        self.received = 0
+        self.dropped = 0
+
+        self._queue = deque(maxlen = max(queue_depth, 1))
+        self._cond = threading.Condition()
+        self.thread = None
+        if queue_depth > 0:
+            self.thread = threading.Thread(target=self._run, name=name)
+            self.thread.daemon = True
+
+    def start(self):
+        if self.thread is not None:
+            self.thread.start()
+            self.subscriber.Init(self._on_sample)
+        else:
+            self.subscriber.Init(self._handle)
+
+    def _handle(self, msg):
+        self.received += 1
+        self.handler(msg)
+
+    def _on_sample(self, msg):
+        with self._cond:
+            self.received += 1
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(msg)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                if self.latest_only:
+                    msgs = (self._queue.pop(),)
+                    self.dropped += len(self._queue)
+                else:
+                    msgs = tuple(self._queue)
+                self._queue.clear()
+            for msg in msgs:
+                self.handler(msg)
+
+
+def check_loopback(samples = 1000, period = 0.002, queue_depth = 1, max_p99_latency = 5e-3):
+    '''Publish lowstate on the local interface through a SampleIngestor; return a list of failures (empty when fine).
+
+    Every sample must arrive, only samples superseded in the queue may be dropped, and the 99th
+    percentile of the publish-to-handler latency must stay below ``max_p99_latency`` seconds.
+    Needs unitree_sdk2py.'''
+    from unitree_sdk2py.core.channel import ChannelPublisher, ChannelSubscriber, ChannelFactoryInitialize
+    from unitree_sdk2py.idl.unitree_hg.msg.dds_ import LowState_
+    from unitree_sdk2py.idl.default import unitree_hg_msg_dds__LowState_
+
+    ChannelFactoryInitialize(0, "lo")
+    publisher = ChannelPublisher("rt/lowstate_loopback", LowState_)
+    publisher.Init()
+
+    sent_at = {}
+    latencies = []
+    def on_lowstate(msg):
+        latencies.append(time.perf_counter() - sent_at[msg.tick])
+
+    ingestor = SampleIngestor(ChannelSubscriber("rt/lowstate_loopback", LowState_), on_lowstate,
+                              queue_depth = queue_depth)
+    ingestor.start()
+    time.sleep(0.5)
+
+    msg = unitree_hg_msg_dds__LowState_()
+    for tick in range(samples):
+        msg.tick = tick
+        sent_at[tick] = time.perf_counter()
+        publisher.Write(msg)
+        time.sleep(period)
+    time.sleep(0.1)
+
+    latencies.sort()
+    print(f"sent {samples}, received {ingestor.received}, handled {len(latencies)}, dropped {ingestor.dropped}")
+    failures = []
+    if ingestor.received != samples:
+        failures.append(f"{samples - ingestor.received} samples never reached the listener")
+    if len(latencies) + ingestor.dropped != ingestor.received:
+        failures.append(f"{ingestor.received - len(latencies) - ingestor.dropped} samples lost in the queue")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+        print(f"latency median {latencies[len(latencies) // 2] * 1e3:.3f} ms, p99 {p99 * 1e3:.3f} ms, "
+              f"max {latencies[-1] * 1e3:.3f} ms")
+        if p99 > max_p99_latency:
+            failures.append(f"p99 latency {p99 * 1e3:.3f} ms above {max_p99_latency * 1e3:.3f} ms")
+    else:
+        failures.append("no samples handled")
+    return failures
+
+
+if __name__ == "__main__":
+    # Loopback check of the event-driven ingestion path; exit 1 when a sample is lost or late.
+    import sys
+
+    failures = check_loopback()
+    for failure in failures:
+        print(f"SampleIngestor loopback: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
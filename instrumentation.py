@@ -0,0 +1,166 @@
+import contextlib
+import functools
+import json
+import threading
+import time
+import numpy as np
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+_SUB_BITS = 5
+_HALF = 1 << (_SUB_BITS - 1)
+_NUM_BUCKETS = 64 * _HALF + _HALF
+
+
+class LatencyHistogram:
+    '''HDR-style log-linear histogram of durations in nanoseconds.
+
+    Values below 32 ns get their own bucket; above that every power of two is split into 16
+    sub-buckets, i.e. ~6% worst-case relative error over the whole int64 range. Recording is
+    a couple of integer ops and one list increment.
+    '''
+    def __init__(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value_ns):
+        value_ns = max(int(value_ns), 0)
+        shift = value_ns.bit_length() - _SUB_BITS
+        if shift <= 0:
+            self.counts[value_ns] += 1
+        else:
+            self.counts[shift * _HALF + (value_ns >> shift)] += 1
+        self.count += 1
+        self.total += value_ns
+        if self.min is None or value_ns < self.min:
+            self.min = value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    @staticmethod
+    def bucket_value(index):
+        '''Lower bound (ns) of the values falling into bucket ``index``.'''
+        shift = max(0, index // _HALF - 1)
+        return (index - shift * _HALF) << shift
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        rank = max(1, int(np.ceil(p / 100.0 * self.count)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.bucket_value(index), self.max)
+
+    def reset(self):
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def snapshot(self):
+        '''Return count, mean, min, max and percentiles in microseconds.'''
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count / 1e3,
+            "min_us": self.min / 1e3,
+            "p50_us": self.percentile(50) / 1e3,
+            "p90_us": self.percentile(90) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "p999_us": self.percentile(99.9) / 1e3,
+            "max_us": self.max / 1e3,
+        }
+
+
+class ControllerMetrics:
+    '''Named latency histograms for one controller, with a snapshot API and an optional periodic reporter.'''
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {}
+        self._reporter = None
+
+    def histogram(self, key):
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = LatencyHistogram()
+        return hist
+
+    def record(self, key, value_ns):
+        self.histogram(key).record(value_ns)
+
+    def record_seconds(self, key, seconds):
+        self.histogram(key).record(seconds * 1e9)
+
+    def snapshot(self):
+        return {key: hist.snapshot() for key, hist in list(self.histograms.items())}
+
+    def reset(self):
+        for hist in list(self.histograms.values()):
+            hist.reset()
+
+    def start_reporter(self, interval = 10.0, path = None, level = logging_mp.WARNING):
+        '''Every ``interval`` seconds log a summary at ``level``, or write the full snapshot as JSON to ``path``.
+
+        The default level is WARNING, which logging_mp shows without any configuration.'''
+        def report():
+            while True:
+                time.sleep(interval)
+                snapshot = self.snapshot()
+                if path is not None:
+                    with open(path, "w") as f:
+                        json.dump({"name": self.name, "time": time.time(), "metrics": snapshot}, f, indent=2)
+                else:
+                    summary = ", ".join(f"{key} p50={s['p50_us']:.1f}us p99={s['p99_us']:.1f}us max={s['max_us']:.1f}us"
+                                        for key, s in snapshot.items() if s["count"])
+                    logger_mp.log(level, f"[{self.name}] {summary}")
+
+        self._reporter = threading.Thread(target=report, name=f"{self.name}_metrics")
+        self._reporter.daemon = True
+        self._reporter.start()
+
+
+class PhaseTimer:
+    '''Wall-clock durations of named startup phases, which may overlap and run in several threads.'''
+    def __init__(self, name):
+        self.name = name
+        self.start = time.monotonic()
+        self.phases = {}  # phase -> (start offset, duration) in seconds
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, key):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                self.phases[key] = (start - self.start, end - start)
+
+    def report(self):
+        '''Log every phase (start offset and duration) and the total time since construction.'''
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1][0])
+        summary = ", ".join(f"{key} +{offset * 1e3:.0f}ms {duration * 1e3:.0f}ms" for key, (offset, duration) in phases)
+        logger_mp.info(f"[{self.name}] startup {(time.monotonic() - self.start) * 1e3:.0f}ms: {summary}")
+
+
+def timed(key):
+    '''Method decorator recording the call cost into ``self.metrics`` (skipped when metrics is None).'''
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return fn(self, *args, **kwargs)
+            start = time.perf_counter_ns()
+            result = fn(self, *args, **kwargs)
+            metrics.record(key, time.perf_counter_ns() - start)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,153 @@
+import zlib
+import numpy as np
+
+G1_29_Num_Motors = 35
+
+# Packed layout of unitree_hg LowCmd_ as used by unitree_sdk2py.utils.crc.CRC ('<2B2x' + 'B3x5fI' * 35 + '5I', 1004 bytes)
+HG_MOTOR_CMD_DTYPE = np.dtype([
+    ("mode", "u1"), ("_pad", "V3"),
+    ("q", "<f4"), ("dq", "<f4"), ("tau", "<f4"), ("kp", "<f4"), ("kd", "<f4"),
+    ("reserve", "<u4"),
+])
+HG_LOWCMD_DTYPE = np.dtype([
+    ("mode_pr", "u1"), ("mode_machine", "u1"), ("_pad", "V2"),
+    ("motor_cmd", HG_MOTOR_CMD_DTYPE, (G1_29_Num_Motors,)),
+    ("reserve", "<u4", (4,)),
+    ("crc", "<u4"),
+])
+
+_BIT_REVERSE = np.array([int(f"{i:08b}"[::-1], 2) for i in range(256)], dtype=np.uint8)
+
+
+def _reverse32(value):
+    return int(f"{value:032b}"[::-1], 2)
+
+
+def crc32_words(data):
+    '''CRC-32 of the little-endian 32-bit words in ``data``, identical to unitree_sdk2py's CRC.
+
+    The SDK feeds every word MSB first into a CRC-32/MPEG-2 (poly 0x04C11DB7, init 0xFFFFFFFF,
+    no reflection, no final xor). That equals zlib's reflected CRC-32 over the bit-reversed
+    big-endian bytes, bit-reversed back, so the whole computation runs in numpy and zlib.
+    '''
+    words = np.frombuffer(data, dtype="<u4")
+    reflected = _BIT_REVERSE[words.astype(">u4").view(np.uint8)]
+    return _reverse32(zlib.crc32(reflected.tobytes(), 0) ^ 0xFFFFFFFF)
+
+
+class LowCmdEncoder:
+    '''Packed mirror of a unitree_hg LowCmd_ that keeps its CRC cheap to recompute.
+
+    The message is packed once; afterwards ``set_arm`` compares the new arm q/dq/tau with the
+    packed float32 values and only touches the changed entries, both in the buffer and in the
+    LowCmd_ handed to DDS. ``crc`` runs over the buffer with the vectorized ``crc32_words``.
+    Any other write to the message must go through ``set_motor`` (or be followed by ``sync``).
+    '''
+    def __init__(self, msg, arm_slice):
+        self.msg = msg
+        self.arm_slice = arm_slice
+        self.buffer = np.zeros(1, dtype=HG_LOWCMD_DTYPE)
+        self.motor = self.buffer["motor_cmd"][0]
+        self._bytes = self.buffer.view(np.uint8)[:HG_LOWCMD_DTYPE.itemsize - 4]
+
+        num_arm = arm_slice.stop - arm_slice.start
+        self._arm = self.motor[arm_slice]
+        self._new = np.zeros((3, num_arm), dtype=np.float32)
+        self._changed = np.zeros(num_arm, dtype=bool)
+        self.sync()
+
+    def sync(self):
+        '''Repack the whole message into the buffer.'''
+        msg, buffer = self.msg, self.buffer[0]
+        buffer["mode_pr"] = msg.mode_pr
+        buffer["mode_machine"] = msg.mode_machine
+        for i, cmd in enumerate(msg.motor_cmd):
+            self.motor[i] = (cmd.mode, b"", cmd.q, cmd.dq, cmd.tau, cmd.kp, cmd.kd, cmd.reserve)
+        buffer["reserve"] = msg.reserve
+
+    def set_motor(self, index, **fields):
+        '''Set fields of ``motor_cmd[index]`` in both the message and the packed buffer.'''
+        cmd = self.msg.motor_cmd[index]
+        for name, value in fields.items():
+            setattr(cmd, name, value)
+            self.motor[name][index] = value
+
+    def set_arm(self, q, dq, tau):
+        '''Write the arm q/dq/tau targets, patching only the entries whose float32 value changed.'''
+        new, arm = self._new, self._arm
+        new[0], new[1], new[2] = q, dq, tau
+        changed = self._changed
+        np.not_equal(arm["q"], new[0], out=changed)
+        changed |= arm["dq"] != new[1]
+        changed |= arm["tau"] != new[2]
+        if not changed.any():
+            return
+        indices = np.flatnonzero(changed)
+        arm["q"][indices] = new[0][indices]
+        arm["dq"][indices] = new[1][indices]
+        arm["tau"][indices] = new[2][indices]
+        motor_cmd, start = self.msg.motor_cmd, self.arm_slice.start
+        for i in indices.tolist():
+            cmd = motor_cmd[start + i]
+            cmd.q = q[i]
+            cmd.dq = dq[i]
+            cmd.tau = tau[i]
+
+    def crc(self):
+        '''Return the CRC of the packed message (everything before the crc field).'''
+        return crc32_words(self._bytes)
+
+    def pack(self):
+        '''Return the packed bytes the CRC is computed over, as the SDK's CRC packs them.'''
+        return self._bytes.tobytes()
+
+
+def check_against_sdk(steps = 1000, seed = 0):
+    '''Drive an encoder and a LowCmd_ with random commands; return the first step whose packed bytes or CRC
+    differ from the SDK CRC path, or None when all ``steps`` match. Needs unitree_sdk2py.'''
+    import struct
+    from unitree_sdk2py.idl.default import unitree_hg_msg_dds__LowCmd_
+    from unitree_sdk2py.utils.crc import CRC
+
+    crc = CRC()
+    rng = np.random.default_rng(seed)
+    arm_slice = slice(15, 29)
+
+    msg = unitree_hg_msg_dds__LowCmd_()
+    msg.mode_machine = 5
+    for i, cmd in enumerate(msg.motor_cmd):
+        cmd.mode = 1
+        cmd.kp = float(rng.uniform(0, 300))
+        cmd.kd = float(rng.uniform(0, 3))
+        cmd.q = float(rng.uniform(-2, 2))
+    encoder = LowCmdEncoder(msg, arm_slice)
+
+    for step in range(steps):
+        q = rng.uniform(-2, 2, 14)
+        tau = rng.uniform(-5, 5, 14)
+        if step % 3 == 0:
+            q[:7] = [msg.motor_cmd[15 + i].q for i in range(7)]  # leave some entries unchanged
+        encoder.set_arm(q, np.zeros(14), tau)
+        if step % 100 == 0:
+            encoder.set_motor(29, q = float(rng.uniform(0, 1)))
+
+        reference = [msg.mode_pr, msg.mode_machine]
+        for cmd in msg.motor_cmd:
+            reference += [cmd.mode, cmd.q, cmd.dq, cmd.tau, cmd.kp, cmd.kd, cmd.reserve]
+        reference += list(msg.reserve) + [0]
+        packed = struct.pack('<2B2x' + 'B3x5fI' * 35 + '5I', *reference)[:-4]
+        if encoder.pack() != packed or encoder.crc() != crc.Crc(msg):
+            return step
+    return None
+
+
+if __name__ == "__main__":
+    # Check that the encoder path is byte-identical to the SDK path on random commands; exit 1 when not.
+    import sys
+
+    steps = 1000
+    step = check_against_sdk(steps)
+    if step is not None:
+        print(f"LowCmdEncoder differs from the SDK CRC path at step {step}.", file=sys.stderr)
+        sys.exit(1)
+    print(f"LowCmdEncoder matches the SDK CRC path on {steps} random commands.")
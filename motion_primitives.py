@@ -0,0 +1,147 @@
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+
+class MotionPrimitive:
+    '''A short behaviour executed by the controller's publish thread, one ``step`` per control tick.
+
+    ``start`` and ``step`` receive the controller and the tick's deadline (monotonic seconds).
+    ``step`` returns ``(done, result)``; the result (or any exception raised) completes
+    ``future``. Callers wait on the future, or ``await asyncio.wrap_future(future)``.
+    Starting a primitive supersedes a running one on the same ``channel``, whose future is
+    then cancelled. The future stays pending until the primitive finishes, so a caller can
+    also ``cancel()`` it to stop the primitive at the next tick.
+    '''
+    channel = None
+
+    def __init__(self):
+        self.future = Future()
+
+    def start(self, controller, now):
+        pass
+
+    def step(self, controller, now):
+        raise NotImplementedError
+
+
+class PrimitiveRunner:
+    '''Hands primitives from any thread to the control thread and steps the running ones each tick.'''
+    def __init__(self, controller):
+        self.controller = controller
+        self._pending = deque()
+        self.running = []
+
+    def submit(self, primitive):
+        self._pending.append(primitive)
+        return primitive.future
+
+    @staticmethod
+    def _finish(future, result = None, exception = None):
+        # futures are left pending while running so that Future.cancel() works on them;
+        # a cancel that raced with the last step wins
+        if not future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def step(self, now):
+        while self._pending:
+            primitive = self._pending.popleft()
+            if primitive.future.cancelled():
+                continue
+            if primitive.channel is not None:
+                for other in [p for p in self.running if p.channel == primitive.channel]:
+                    self.running.remove(other)
+                    other.future.cancel()
+            try:
+                primitive.start(self.controller, now)
+            except Exception as e:
+                self._finish(primitive.future, exception = e)
+                continue
+            self.running.append(primitive)
+
+        if not self.running:
+            return
+        for primitive in list(self.running):
+            if primitive.future.cancelled():
+                self.running.remove(primitive)
+                continue
+            try:
+                done, result = primitive.step(self.controller, now)
+            except Exception as e:
+                self.running.remove(primitive)
+                self._finish(primitive.future, exception = e)
+                continue
+            if done:
+                self.running.remove(primitive)
+                self._finish(primitive.future, result)
+
+
+class GoHome(MotionPrimitive):
+    '''Command both arms to q = 0 and wait until every joint is within ``tolerance``.
+
+    In motion mode the arm-control weight (``weight_index``, kNotUsedJoint0) is then ramped from
+    1 to 0 over ``release_time`` seconds. The result is True once home, False on ``timeout``.
+    '''
+    channel = "arms"
+
+    def __init__(self, weight_index, tolerance = 0.05, timeout = 5.0, release_time = 2.0):
+        super().__init__()
+        self.weight_index = weight_index
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.release_time = release_time
+        self._deadline = None
+        self._release_start = None
+
+    def start(self, controller, now):
+        logger_mp.info("[G1_29_ArmController] ctrl_dual_arm_go_home start...")
+        controller.command.write(np.zeros(controller.command.size))  # keeps the current feedforward torque
+        controller.trajectory.cancel()
+        self._deadline = now + self.timeout
+
+    def step(self, controller, now):
+        if self._release_start is None:
+            if np.all(np.abs(controller.get_current_dual_arm_q(view = True)) < self.tolerance):
+                if not controller.motion_mode:
+                    logger_mp.info("[G1_29_ArmController] both arms have reached the home position.")
+                    return True, True
+                self._release_start = now
+            elif now >= self._deadline:
+                logger_mp.warning("[G1_29_ArmController] go home timed out before both arms reached the home position.")
+                return True, False
+            else:
+                return False, None
+
+        weight = max(0.0, 1.0 - (now - self._release_start) / self.release_time)
+        controller.encoder.set_motor(self.weight_index, q = weight)
+        if weight > 0.0:
+            return False, None
+        logger_mp.info("[G1_29_ArmController] both arms have reached the home position.")
+        return True, True
+
+
+class SpeedRamp(MotionPrimitive):
+    '''Raise ``arm_velocity_limit`` linearly from ``start_limit`` to ``end_limit`` over ``duration`` seconds.'''
+    channel = "speed"
+
+    def __init__(self, duration, start_limit = 20.0, end_limit = 30.0):
+        super().__init__()
+        self.duration = duration
+        self.start_limit = start_limit
+        self.end_limit = end_limit
+        self._start = None
+
+    def start(self, controller, now):
+        self._start = now
+
+    def step(self, controller, now):
+        fraction = 1.0 if self.duration <= 0 else min(1.0, (now - self._start) / self.duration)
+        controller.arm_velocity_limit = self.start_limit + (self.end_limit - self.start_limit) * fraction
+        return fraction >= 1.0, controller.arm_velocity_limit
@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+G1_29_Num_Motors = 35
+Inspire_Num_States = 12
+
+# stream name -> [(field, per-sample shape, dtype)]
+STREAM_FIELDS = {
+    "lowstate": [
+        ("stamp", (), np.float64),
+        ("tick", (), np.uint32),
+        ("crc", (), np.uint32),
+        ("mode_machine", (), np.uint8),
+        ("q", (G1_29_Num_Motors,), np.float64),
+        ("dq", (G1_29_Num_Motors,), np.float64),
+        ("tau", (G1_29_Num_Motors,), np.float64),
+    ],
+    "hand_state": [
+        ("stamp", (), np.float64),
+        ("q", (Inspire_Num_States,), np.float64),
+    ],
+    "lowcmd": [
+        ("stamp", (), np.float64),
+        ("mode", (G1_29_Num_Motors,), np.uint8),
+        ("q", (G1_29_Num_Motors,), np.float32),
+        ("dq", (G1_29_Num_Motors,), np.float32),
+        ("tau", (G1_29_Num_Motors,), np.float32),
+        ("kp", (G1_29_Num_Motors,), np.float32),
+        ("kd", (G1_29_Num_Motors,), np.float32),
+        ("crc", (), np.uint32),
+    ],
+}
+
+
+class _Stream:
+    '''Single-producer ring of preallocated columns, flushed into memory-mapped ``.npy`` segments.'''
+    def __init__(self, name, fields, directory, capacity, segment_samples):
+        self.name = name
+        self.fields = fields
+        self.directory = os.path.join(directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.capacity = capacity
+        self.segment_samples = segment_samples
+        self.columns = {field: np.zeros((capacity, *shape), dtype=dtype) for field, shape, dtype in fields}
+
+        self.head = 0  # samples reserved by the producer
+        self.tail = 0  # samples flushed by the writer thread
+        self.dropped = 0
+        self.segments = []  # number of valid samples per segment file
+        self._segment = None
+        self._segment_fill = 0
+
+    def reserve(self):
+        '''Return the ring row to fill, or None (and count a drop) when the writer is a full ring behind.'''
+        if self.head - self.tail >= self.capacity:
+            self.dropped += 1
+            return None
+        return self.head % self.capacity
+
+    def commit(self):
+        self.head += 1
+
+    def _open_segment(self):
+        index = len(self.segments)
+        self._segment = {
+            field: np.lib.format.open_memmap(os.path.join(self.directory, f"{index:05d}_{field}.npy"), mode="w+",
+                                             dtype=dtype, shape=(self.segment_samples, *shape))
+            for field, shape, dtype in self.fields
+        }
+        self._segment_fill = 0
+        self.segments.append(0)
+
+    def flush(self):
+        head = self.head
+        while self.tail < head:
+            if self._segment is None or self._segment_fill == self.segment_samples:
+                self._open_segment()
+            start = self.tail % self.capacity
+            count = min(head - self.tail, self.capacity - start, self.segment_samples - self._segment_fill)
+            fill = self._segment_fill
+            for field, column in self.columns.items():
+                self._segment[field][fill:fill + count] = column[start:start + count]
+            self._segment_fill += count
+            self.segments[-1] = self._segment_fill
+            self.tail += count
+
+    def close(self):
+        self.flush()
+        if self._segment is not None:
+            for array in self._segment.values():
+                array.flush()
+            self._segment = None
+        with open(os.path.join(self.directory, "index.json"), "w") as f:
+            json.dump({"fields": [field for field, _, _ in self.fields], "segments": self.segments,
+                       "dropped": self.dropped}, f)
+
+
+class Recorder:
+    '''Full-rate binary recorder for lowstate, hand state and published LowCmd messages.
+
+    Hot threads (DDS ingestion, the 250 Hz publish loop) only copy each sample into preallocated
+    ring columns; a background thread moves them in bulk into chunked, memory-mapped ``.npy``
+    segments (one file per field and segment, ``segment_samples`` rows each) under
+    ``directory/<stream>/``. Memory is bounded by ``capacity`` rows per stream; if the writer
+    falls a full ring behind, new samples are dropped and counted rather than blocking.
+    Every record carries a ``time.monotonic()`` stamp. Read a stream back with ``load_stream``.
+    State buffers filled by an ingestion child process (shm_ingest) cannot notify this process:
+    a separate thread polls them every ``poll_interval`` seconds, which must stay below the time
+    their ring covers (16 slots at 500 Hz: 30 ms) or the overwritten samples are counted as dropped.
+    '''
+    def __init__(self, directory, capacity = 4096, segment_samples = 1 << 16, flush_interval = 0.1,
+                 poll_interval = 0.005):
+        self.directory = directory
+        self.capacity = capacity
+        self.segment_samples = segment_samples
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.streams = {}
+        self._polled = []  # [stream, on_publish, buffer, last seq] for buffers written by another process
+        self._detach = []
+        self._running = False
+        self._thread = None
+        self._poll_thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _stream(self, name):
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = _Stream(name, STREAM_FIELDS[name], self.directory,
+                                                  self.capacity, self.segment_samples)
+        return stream
+
+    def _attach_buffer(self, name, buffer, copy):
+        stream = self._stream(name)
+        def on_publish(buffer, slot):
+            row = stream.reserve()
+            if row is not None:
+                copy(stream.columns, row, buffer, slot)
+                stream.commit()
+        if buffer.shm is None:
+            buffer.listeners.append(on_publish)
+            self._detach.append(lambda: buffer.listeners.remove(on_publish))
+        else:
+            # written by an ingestion child process: pick new slots up from the poll thread
+            self._polled.append([stream, on_publish, buffer, buffer.seq])
+            if self._running:
+                self._start_poll()
+
+    def attach_arm(self, arm):
+        '''Record every lowstate sample and every LowCmd published by a G1_29_ArmController.'''
+        def copy_lowstate(columns, row, buffer, slot):
+            columns["stamp"][row] = buffer.stamp[slot]
+            columns["tick"][row] = buffer.tick[slot]
+            columns["crc"][row] = buffer.crc[slot]
+            columns["mode_machine"][row] = buffer.mode_machine[slot]
+            columns["q"][row] = buffer.q[slot]
+            columns["dq"][row] = buffer.dq[slot]
+            columns["tau"][row] = buffer.tau[slot]
+        self._attach_buffer("lowstate", arm.lowstate_buffer, copy_lowstate)
+
+        stream = self._stream("lowcmd")
+        columns = stream.columns
+        motor_fields = [(columns[field], arm.encoder.motor[field]) for field in ("mode", "q", "dq", "tau", "kp", "kd")]
+        stamp_column, crc_column = columns["stamp"], columns["crc"]
+        def on_lowcmd(stamp, crc):
+            row = stream.reserve()
+            if row is not None:
+                stamp_column[row] = stamp
+                for column, values in motor_fields:
+                    column[row] = values
+                crc_column[row] = crc
+                stream.commit()
+        arm.lowcmd_listeners.append(on_lowcmd)
+        self._detach.append(lambda: arm.lowcmd_listeners.remove(on_lowcmd))
+
+    def attach_hand(self, hand):
+        '''Record every hand state sample of an Inspire controller.'''
+        def copy_hand_state(columns, row, buffer, slot):
+            columns["stamp"][row] = buffer.stamp[slot]
+            columns["q"][row] = buffer.q[slot]
+        self._attach_buffer("hand_state", hand.hand_state_buffer, copy_hand_state)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="recorder")
+        self._thread.daemon = True
+        self._thread.start()
+        if self._polled:
+            self._start_poll()
+        return self
+
+    def _start_poll(self):
+        if self._poll_thread is None:
+            self._poll_thread = threading.Thread(target=self._run_poll, name="recorder_poll")
+            self._poll_thread.daemon = True
+            self._poll_thread.start()
+
+    def _poll(self):
+        for entry in self._polled:
+            stream, on_publish, buffer, last_seq = entry
+            seq = buffer.seq
+            missed = seq - last_seq - (buffer.num_slots - 1)
+            if missed > 0:
+                stream.dropped += missed
+                last_seq += missed
+            for s in range(last_seq + 1, seq + 1):
+                on_publish(buffer, s % buffer.num_slots)
+            entry[3] = seq
+
+    def _run_poll(self):
+        while self._running:
+            time.sleep(self.poll_interval)
+            self._poll()
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.flush_interval)
+            for stream in list(self.streams.values()):
+                stream.flush()
+
+    def close(self):
+        '''Detach from the controllers, flush everything and write each stream's index.'''
+        for detach in self._detach:
+            detach()
+        self._detach = []
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        if self._poll_thread is not None:
+            self._poll_thread.join()
+            self._poll_thread = None
+        self._poll()
+        for stream in self.streams.values():
+            stream.close()
+            if stream.dropped:
+                logger_mp.warning(f"[Recorder] {stream.name}: dropped {stream.dropped} samples")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_stream(directory, name, mmap_mode = "r"):
+    '''Return ``{field: array}`` for one recorded stream, concatenating its segments.
+
+    Fields added after a log was recorded (not in its index) are returned as zeros.'''
+    stream_dir = os.path.join(directory, name)
+    with open(os.path.join(stream_dir, "index.json")) as f:
+        index = json.load(f)
+    out = {}
+    num_samples = sum(index["segments"])
+    for field, shape, dtype in STREAM_FIELDS[name]:
+        if field not in index["fields"]:
+            out[field] = np.zeros((num_samples, *shape), dtype=dtype)
+            continue
+        parts = [np.load(os.path.join(stream_dir, f"{i:05d}_{field}.npy"), mmap_mode=mmap_mode)[:count]
+                 for i, count in enumerate(index["segments"])]
+        if not parts:
+            out[field] = np.zeros((0, *shape), dtype=dtype)
+        else:
+            out[field] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+    return out
@@ -0,0 +1,130 @@
+import argparse
+import time
+import numpy as np
+
+from unitree_sdk2py.core.channel import ChannelPublisher, ChannelFactoryInitialize
+from unitree_sdk2py.idl.unitree_hg.msg.dds_ import LowState_ as hg_LowState
+from unitree_sdk2py.idl.unitree_go.msg.dds_ import MotorStates_
+from unitree_sdk2py.idl.default import unitree_hg_msg_dds__LowState_, unitree_go_msg_dds__MotorState_
+
+from buffers import LowStateBuffer
+from recorder import load_stream
+from robot_control import kTopicLowState
+from robot_hand_inspire import kTopicInspireDFXState
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+
+class ReplayPublisher:
+    '''Republish a Recorder log on rt/lowstate and rt/inspire/state, standing in for the robot or simulator.
+
+    Both streams are merged on their recorded monotonic stamps. ``speed`` scales time: 1.0 is
+    real time, N is N times faster, and 0 publishes as fast as possible. ``topic_prefix`` is
+    prepended to both topics, matching the controllers' option of the same name.
+    '''
+    def __init__(self, directory, speed = 1.0, topic_prefix = ""):
+        self.speed = speed
+        self.streams = []
+
+        lowstate = self._load(directory, "lowstate")
+        if lowstate is not None:
+            publisher = ChannelPublisher(topic_prefix + kTopicLowState, hg_LowState)
+            publisher.Init()
+            self.streams.append((lowstate, publisher, unitree_hg_msg_dds__LowState_(), self._fill_lowstate))
+
+        hand_state = self._load(directory, "hand_state")
+        if hand_state is not None:
+            publisher = ChannelPublisher(topic_prefix + kTopicInspireDFXState, MotorStates_)
+            publisher.Init()
+            msg = MotorStates_(states=[unitree_go_msg_dds__MotorState_() for _ in range(hand_state["q"].shape[1])])
+            self.streams.append((hand_state, publisher, msg, self._fill_hand_state))
+
+        assert self.streams, f"no lowstate or hand_state recording found in {directory}"
+
+        # merged schedule: (stamp, stream index, row) sorted by stamp
+        stamps = np.concatenate([data["stamp"] for data, *_ in self.streams])
+        stream_index = np.concatenate([np.full(len(data["stamp"]), i) for i, (data, *_) in enumerate(self.streams)])
+        rows = np.concatenate([np.arange(len(data["stamp"])) for data, *_ in self.streams])
+        order = np.argsort(stamps, kind="stable")
+        self.stamps = stamps[order] - stamps[order][0] if len(order) else stamps
+        self.stream_index = stream_index[order]
+        self.rows = rows[order]
+
+    @staticmethod
+    def _load(directory, name):
+        try:
+            return load_stream(directory, name)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _fill_lowstate(msg, data, row):
+        msg.tick = int(data["tick"][row])
+        msg.crc = int(data["crc"][row])
+        msg.mode_machine = int(data["mode_machine"][row])
+        for motor, q, dq, tau in zip(msg.motor_state, data["q"][row].tolist(), data["dq"][row].tolist(),
+                                     data["tau"][row].tolist()):
+            motor.q = q
+            motor.dq = dq
+            motor.tau_est = tau
+
+    @staticmethod
+    def _fill_hand_state(msg, data, row):
+        for state, q in zip(msg.states, data["q"][row].tolist()):
+            state.q = q
+
+    def check_lowstate(self):
+        '''Feed the lowstate log through a LowStateBuffer, as a subscriber would; return (published, recorded).
+
+        Every recorded sample was published once by the recording controller, so a faithful
+        replay publishes all of them again (none is taken for a re-delivery).'''
+        for data, _, msg, fill in self.streams:
+            if fill is self._fill_lowstate:
+                buffer = LowStateBuffer(data["q"].shape[1])
+                for row in range(len(data["stamp"])):
+                    fill(msg, data, row)
+                    buffer.write(msg)
+                return buffer.seq, len(data["stamp"])
+        return 0, 0
+
+    def run(self, loop = False):
+        '''Publish the log once (or forever with ``loop``), paced on the monotonic clock.'''
+        while True:
+            start = time.monotonic()
+            for stamp, i, row in zip(self.stamps.tolist(), self.stream_index.tolist(), self.rows.tolist()):
+                if self.speed > 0:
+                    delay = start + stamp / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                data, publisher, msg, fill = self.streams[i]
+                fill(msg, data, row)
+                publisher.Write(msg)
+            elapsed = time.monotonic() - start
+            logger_mp.info(f"[ReplayPublisher] replayed {len(self.rows)} samples in {elapsed:.2f} s")
+            if not loop:
+                return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a Recorder log as a local DDS stand-in for the robot.")
+    parser.add_argument("directory", help="Recorder output directory")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale: 1 real time, N for N x, 0 as fast as possible")
+    parser.add_argument("--loop", action="store_true", help="restart from the beginning when the log ends")
+    parser.add_argument("--domain-id", type=int, default=1, help="DDS domain (0 real robot, 1 simulation)")
+    parser.add_argument("--network-interface", default=None, help="e.g. lo to stay on this machine")
+    parser.add_argument("--topic-prefix", default="", help="prepended to the topics, to stand in for one of several robots")
+    parser.add_argument("--check", action="store_true",
+                        help="only verify that the replayed lowstate reproduces the recorded sample count")
+    args = parser.parse_args()
+
+    if args.network_interface is None:
+        ChannelFactoryInitialize(args.domain_id)
+    else:
+        ChannelFactoryInitialize(args.domain_id, args.network_interface)
+    replay = ReplayPublisher(args.directory, args.speed, args.topic_prefix)
+    if args.check:
+        published, recorded = replay.check_lowstate()
+        logger_mp.info(f"[ReplayPublisher] lowstate round trip: {published} of {recorded} samples published")
+        raise SystemExit(0 if published == recorded else 1)
+    replay.run(loop = args.loop)
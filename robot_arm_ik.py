@@ -0,0 +1,226 @@
+import os
+import time
+import numpy as np
+
+from instrumentation import LatencyHistogram
+from robot_assets import ModelCache
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+URDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "g1.urdf")
+
+# reduced model joints, in the order of G1_29_JointArmIndex (left arm, then right arm)
+G1_29_ARM_JOINT_NAMES = [
+    "left_shoulder_pitch_joint", "left_shoulder_roll_joint", "left_shoulder_yaw_joint", "left_elbow_joint",
+    "left_wrist_roll_joint", "left_wrist_pitch_joint", "left_wrist_yaw_joint",
+    "right_shoulder_pitch_joint", "right_shoulder_roll_joint", "right_shoulder_yaw_joint", "right_elbow_joint",
+    "right_wrist_roll_joint", "right_wrist_pitch_joint", "right_wrist_yaw_joint",
+]
+
+
+def build_arm_model(urdf_path = URDF_PATH):
+    '''Return the ``g1.urdf`` pinocchio model reduced to G1_29_ARM_JOINT_NAMES, every other joint locked at neutral.'''
+    import pinocchio as pin
+    full_model = ModelCache().model(urdf_path)
+    locked = [full_model.getJointId(name) for name in full_model.names[1:] if name not in G1_29_ARM_JOINT_NAMES]
+    model = pin.buildReducedModel(full_model, locked, pin.neutral(full_model))
+    assert list(model.names[1:]) == G1_29_ARM_JOINT_NAMES, "unexpected arm joint order in the reduced model"
+    return model
+
+
+class G1_29_ArmIK:
+    '''Damped least-squares IK of both wrists on the G1 arm sub-model, sized for the control rate.
+
+    The arm sub-model of ``g1.urdf`` (``build_arm_model``: the 14 arm joints, everything else
+    locked at neutral) gets ``L_ee`` / ``R_ee`` frames ``ee_offset`` metres along the wrist yaw
+    links. ``solve_ik`` takes both wrist targets as
+    4x4 homogeneous transforms in the pelvis frame and returns ``(sol_q, sol_tauff)``, ready
+    for ``G1_29_ArmController.ctrl_dual_arm``.
+
+    Each solve starts from the previous solution, or from the measured arm q when the robot is
+    more than ``reseed_threshold`` rad away from it (first call, after go home, ...), and runs
+    at most ``max_iterations`` steps within ``time_budget`` seconds, stopping once both wrists
+    are within tolerance. Every step solves the stacked 12x14 task with damping ``damping``
+    and, in the Jacobian's null space, pulls the joints toward the warm start with gain
+    ``null_gain`` so redundant elbow motion stays smooth from one call to the next. Positions
+    are clipped to the joint limits; ``sol_tauff`` is the gravity torque at the solution.
+    The pinocchio Data and the task buffers are allocated once; ``sol_q`` and ``sol_tauff``
+    are reused between calls. ``stats()`` reports convergence and solve-time percentiles.
+    '''
+    def __init__(self, urdf_path = URDF_PATH, max_iterations = 10, time_budget = 2e-3, damping = 1e-2,
+                 null_gain = 0.1, rotation_weight = 0.5, position_tolerance = 1e-3, rotation_tolerance = 1e-2,
+                 reseed_threshold = 0.3, ee_offset = 0.05):
+        import pinocchio as pin
+        self._pin = pin
+        self.model = build_arm_model(urdf_path)
+
+        self.ee_frame_ids = []
+        for side in ("left", "right"):
+            parent_frame = self.model.getFrameId(f"{side}_wrist_yaw_link")
+            placement = pin.SE3(np.eye(3), np.array([ee_offset, 0.0, 0.0]))
+            frame = pin.Frame(f"{side[0].upper()}_ee", self.model.frames[parent_frame].parentJoint, parent_frame,
+                              placement, pin.FrameType.OP_FRAME)
+            self.ee_frame_ids.append(self.model.addFrame(frame))
+        self.data = self.model.createData()
+
+        self.max_iterations = max_iterations
+        self.time_budget = time_budget
+        self.damping = damping
+        self.null_gain = null_gain
+        self.rotation_weight = rotation_weight
+        self.position_tolerance = position_tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.reseed_threshold = reseed_threshold
+
+        nv = self.model.nv
+        self.lower = self.model.lowerPositionLimit.copy()
+        self.upper = self.model.upperPositionLimit.copy()
+        self.q = pin.neutral(self.model)
+        self._q_ref = np.zeros(nv)
+        self._has_solution = False
+        self._J = np.zeros((12, nv))
+        self._error = np.zeros(12)
+        self._JJt = np.zeros((12, 12))
+        self._damping_eye = damping * damping * np.eye(12)
+        self._z = np.zeros(nv)
+        self._dq = np.zeros(nv)
+        self._targets = np.zeros((2, 4, 4))
+        self.sol_q = np.zeros(nv)
+        self.sol_tauff = np.zeros(nv)
+
+        self.solve_time = LatencyHistogram()
+        self.solves = 0
+        self.converged = 0
+        self.reseeds = 0
+        self.iterations = 0
+        self.position_error = 0.0
+        self.rotation_error = 0.0
+
+    def _task(self, q):
+        '''Fill the weighted 12-D wrist error and its Jacobian at ``q``; return the largest position and rotation errors.'''
+        pin = self._pin
+        pin.computeJointJacobians(self.model, self.data, q)
+        pin.updateFramePlacements(self.model, self.data)
+        position_error = rotation_error = 0.0
+        for k, frame_id in enumerate(self.ee_frame_ids):
+            rows = slice(6 * k, 6 * k + 6)
+            oMf = self.data.oMf[frame_id]
+            target = self._targets[k]
+            error = self._error[rows]
+            error[:3] = target[:3, 3] - oMf.translation
+            error[3:] = pin.log3(target[:3, :3] @ oMf.rotation.T)
+            position_error = max(position_error, float(np.linalg.norm(error[:3])))
+            rotation_error = max(rotation_error, float(np.linalg.norm(error[3:])))
+            self._J[rows] = pin.getFrameJacobian(self.model, self.data, frame_id, pin.LOCAL_WORLD_ALIGNED)
+            error[3:] *= self.rotation_weight
+            self._J[6 * k + 3:6 * k + 6] *= self.rotation_weight
+        return position_error, rotation_error
+
+    def solve_ik(self, left_wrist, right_wrist, current_lr_arm_q = None, current_lr_arm_dq = None):
+        '''Return ``(sol_q, sol_tauff)`` placing the wrists at the 4x4 ``left_wrist`` / ``right_wrist`` targets.
+
+        ``current_lr_arm_q`` (measured arm q) reseeds the solver when it is far from the previous
+        solution; ``current_lr_arm_dq`` is accepted for the caller's signature and not used.'''
+        start = time.perf_counter()
+        deadline = start + self.time_budget
+        self._targets[0] = left_wrist
+        self._targets[1] = right_wrist
+
+        q = self.q
+        if current_lr_arm_q is not None and (not self._has_solution or
+                                             np.max(np.abs(current_lr_arm_q - q)) > self.reseed_threshold):
+            q[:] = current_lr_arm_q
+            self.reseeds += 1
+        self._q_ref[:] = q
+
+        J, error, z, dq = self._J, self._error, self._z, self._dq
+        iterations = 0
+        while True:
+            position_error, rotation_error = self._task(q)
+            converged = position_error < self.position_tolerance and rotation_error < self.rotation_tolerance
+            if converged or iterations >= self.max_iterations or time.perf_counter() >= deadline:
+                break
+            # dq = J+ e + (I - J+ J) z, with the damped pseudo-inverse J+ = J^T (J J^T + l^2 I)^-1
+            np.dot(J, J.T, out=self._JJt)
+            self._JJt += self._damping_eye
+            pinv_t = np.linalg.solve(self._JJt, J)
+            np.subtract(self._q_ref, q, out=z)
+            z *= self.null_gain
+            np.dot(pinv_t.T, error - J @ z, out=dq)
+            dq += z
+            q += dq
+            np.clip(q, self.lower, self.upper, out=q)
+            iterations += 1
+
+        self._has_solution = True
+        self.sol_q[:] = q
+        self.sol_tauff[:] = self._pin.computeGeneralizedGravity(self.model, self.data, q)
+
+        self.solves += 1
+        self.converged += converged
+        self.iterations += iterations
+        self.position_error = position_error
+        self.rotation_error = rotation_error
+        self.solve_time.record((time.perf_counter() - start) * 1e9)
+        return self.sol_q, self.sol_tauff
+
+    def reset(self):
+        '''Forget the previous solution: the next solve starts from the measured (or neutral) q.'''
+        self._has_solution = False
+        self.q[:] = self._pin.neutral(self.model)
+
+    def stats(self):
+        '''Return solve count, convergence rate, mean iterations, the last errors and solve-time percentiles.'''
+        solves = max(self.solves, 1)
+        return {
+            "solves": self.solves,
+            "converged_ratio": self.converged / solves,
+            "reseeds": self.reseeds,
+            "mean_iterations": self.iterations / solves,
+            "position_error": self.position_error,
+            "rotation_error": self.rotation_error,
+            "solve": self.solve_time.snapshot(),
+        }
+
+
+def check_tracking(num_solves = 2000, min_converged_ratio = 0.99):
+    '''Track a moving pair of reachable wrist targets at control rate; return a list of failures (empty when fine).
+
+    The targets come from the forward kinematics of a smooth joint path sampled at 250 Hz, so at
+    least ``min_converged_ratio`` of the solves must reach the tolerances within their budget.'''
+    import pinocchio as pin
+    arm_ik = G1_29_ArmIK()
+    model, data = arm_ik.model.copy(), arm_ik.model.createData()
+    rng = np.random.default_rng(0)
+    centre = 0.5 * (arm_ik.lower + arm_ik.upper) * 0.3
+    amplitude = 0.25 * (arm_ik.upper - arm_ik.lower) * 0.3
+    phase = rng.uniform(0, 2 * np.pi, model.nq)
+    q_current = centre.copy()
+    start = time.perf_counter()
+    for k in range(num_solves):
+        q_path = centre + amplitude * np.sin(2 * np.pi * 0.5 * k / 250.0 + phase)
+        pin.framesForwardKinematics(model, data, q_path)
+        left, right = (data.oMf[frame_id].homogeneous for frame_id in arm_ik.ee_frame_ids)
+        sol_q, sol_tauff = arm_ik.solve_ik(left, right, q_current)
+        q_current = sol_q.copy()
+    elapsed = time.perf_counter() - start
+    stats = arm_ik.stats()
+    print(f"{num_solves / elapsed:.0f} solves/s, converged {stats['converged_ratio'] * 100:.1f}%, "
+          f"{stats['mean_iterations']:.2f} iterations per solve, solve p50 {stats['solve']['p50_us']:.0f}us "
+          f"p99 {stats['solve']['p99_us']:.0f}us max {stats['solve']['max_us']:.0f}us")
+    failures = []
+    if stats["converged_ratio"] < min_converged_ratio:
+        failures.append(f"converged {stats['converged_ratio'] * 100:.1f}% of the solves, "
+                        f"below {min_converged_ratio * 100:.1f}%")
+    return failures
+
+
+if __name__ == "__main__":
+    # Convergence of the solver on a tracked wrist path; exit 1 when too few solves converge.
+    import sys
+
+    failures = check_tracking()
+    for failure in failures:
+        print(f"G1_29_ArmIK: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
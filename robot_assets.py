@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+from utils import JointTables
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".model_cache")
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+
+def urdf_hash(path):
+    '''SHA-256 of the URDF file content.'''
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ModelCache:
+    '''On-disk cache of what is derived from a URDF, keyed by the hash of its content.
+
+    ``tables`` returns the JointTables (joint map, neutral q, mimic tables) from a ``.npz``
+    without importing pinocchio; ``model`` returns the pinocchio model from its serialized
+    binary. On a miss they are built from the URDF once and stored, so editing the URDF
+    invalidates the entries automatically. Entries are written to a temporary file and renamed
+    into place; the model binary is also keyed by the pinocchio version and rebuilt when it
+    cannot be loaded. Mimic joints do not survive pinocchio's binary
+    serialization (the loaded model crashes in forward kinematics), so only the model without
+    them is cached and ``model(mimic = True)`` parses the URDF every time.
+    '''
+    def __init__(self, directory = CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, urdf_path, kind):
+        return os.path.join(self.directory, f"{os.path.basename(urdf_path)}.{urdf_hash(urdf_path)[:16]}.{kind}")
+
+    def _build(self, urdf_path):
+        import pinocchio as pin
+        model = pin.buildModelFromUrdf(urdf_path, mimic = True)
+        path = self._path(urdf_path, "tables.npz")
+        tmp = f"{path}.{os.getpid()}.part"
+        with open(tmp, "wb") as f:  # a file object: np.savez would append .npz to the name
+            JointTables.from_model(model).save(f)
+        os.replace(tmp, path)
+        logger_mp.info(f"[ModelCache] cached joint tables of {urdf_path}")
+        return model
+
+    def tables(self, urdf_path):
+        path = self._path(urdf_path, "tables.npz")
+        if not os.path.exists(path):
+            self._build(urdf_path)
+        return JointTables.load(path)
+
+    def model(self, urdf_path, mimic = False):
+        import pinocchio as pin
+        if mimic:
+            return pin.buildModelFromUrdf(urdf_path, mimic = True)
+        # the binary format is tied to the pinocchio build that wrote it
+        path = self._path(urdf_path, f"pin{pin.__version__}.rigid.model.bin")
+        if os.path.exists(path):
+            model = pin.Model()
+            try:
+                model.loadFromBinary(path)
+                return model
+            except Exception as e:  # e.g. MemoryError or a boost archive error on a foreign or truncated file
+                logger_mp.warning(f"[ModelCache] discarding unreadable {path}: {e!r}")
+        model = pin.buildModelFromUrdf(urdf_path)
+        tmp = f"{path}.{os.getpid()}.part"
+        model.saveToBinary(tmp)
+        os.replace(tmp, path)
+        logger_mp.info(f"[ModelCache] cached model of {urdf_path}")
+        return model
+
+
+def _urdf_mesh_files(path):
+    files = []
+    for mesh in ET.parse(path).getroot().iter("mesh"):
+        filename = mesh.get("filename")
+        if filename and "://" not in filename and filename not in files:
+            files.append(filename)
+    return files
+
+
+def _download(url, path):
+    tmp = path + ".part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with urllib.request.urlopen(url, timeout=30) as response, open(tmp, "wb") as f:
+        f.write(response.read())
+    os.replace(tmp, path)
+
+
+def _mirror_path(url):
+    # <urdf stem>/<urdf file>, meshes keep their relative paths next to it
+    filename = os.path.basename(urllib.parse.urlparse(url).path)
+    return os.path.join(os.path.splitext(filename)[0], filename)
+
+
+def mirror_urdf(url, directory = ASSET_DIR):
+    '''Download a URDF and the meshes it references (relative paths) into ``directory/<name>/``.
+
+    Returns the URDF path relative to ``directory`` once everything is present locally, so the
+    files can be served by the Vuer app; files already mirrored are not fetched again.
+    '''
+    urdf_rel = _mirror_path(url)
+    urdf_path = os.path.join(directory, urdf_rel)
+    if not os.path.exists(urdf_path):
+        _download(url, urdf_path)
+    for filename in _urdf_mesh_files(urdf_path):
+        mesh_path = os.path.join(os.path.dirname(urdf_path), filename)
+        if not os.path.exists(mesh_path):
+            _download(urllib.parse.urljoin(url, filename), mesh_path)
+    return urdf_rel
+
+
+def local_urdf(url, directory = ASSET_DIR):
+    '''Return the mirrored URDF path relative to ``directory`` if it is complete, else None.
+
+    Nothing is downloaded here: when the mirror is missing or incomplete a background thread
+    fetches it for the next start, and the caller keeps using ``url`` for this run.
+    '''
+    urdf_rel = _mirror_path(url)
+    urdf_path = os.path.join(directory, urdf_rel)
+    if os.path.exists(urdf_path) and all(os.path.exists(os.path.join(os.path.dirname(urdf_path), filename))
+                                         for filename in _urdf_mesh_files(urdf_path)):
+        return urdf_rel
+
+    def fetch():
+        try:
+            mirror_urdf(url, directory)
+            logger_mp.info(f"[robot_assets] mirrored {url} into {directory}, served locally from the next start")
+        except OSError as e:
+            logger_mp.warning(f"[robot_assets] could not mirror {url}: {e}")
+    thread = threading.Thread(target=fetch, name="mirror_urdf")
+    thread.daemon = True
+    thread.start()
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Mirror a remote URDF with its meshes for local serving.")
+    parser.add_argument("url")
+    parser.add_argument("--directory", default=ASSET_DIR)
+    args = parser.parse_args()
+    logger_mp.info(f"[robot_assets] {mirror_urdf(args.url, args.directory)} ready in {args.directory}")
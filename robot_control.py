@@ -6,11 +6,19 @@ from enum import IntEnum, Enum
 from unitree_sdk2py.core.channel import ChannelPublisher, ChannelSubscriber, ChannelFactoryInitialize # dds
 from unitree_sdk2py.idl.unitree_hg.msg.dds_ import ( LowCmd_  as hg_LowCmd, LowState_ as hg_LowState) # idl for g1, h1_2
 from unitree_sdk2py.idl.default import unitree_hg_msg_dds__LowCmd_
-from unitree_sdk2py.utils.crc import CRC
 
 from unitree_sdk2py.idl.unitree_go.msg.dds_ import ( LowCmd_  as go_LowCmd, LowState_ as go_LowState)  # idl for h1
 from unitree_sdk2py.idl.default import unitree_go_msg_dds__LowCmd_
 
+from buffers import LowStateBuffer, CommandSlot
+from dds_ingest import SampleIngestor
+from scheduler import PeriodicScheduler
+from instrumentation import ControllerMetrics, timed
+from lowcmd_encoder import LowCmdEncoder
+from trajectory import ArmTrajectory
+from motion_primitives import PrimitiveRunner, GoHome, SpeedRamp
+from shm_ingest import IngestProcess
+
 import logging_mp
 logger_mp = logging_mp.get_logger(__name__)
 
@@ -56,33 +64,32 @@ URDF_JOINT_MAP = {
 
 }
 
-class MotorState:
-    def __init__(self):
-        self.q = None
-        self.dq = None
-
-class G1_29_LowState:
-    def __init__(self):
-        self.motor_state = [MotorState() for _ in range(G1_29_Num_Motors)]
-
-class DataBuffer:
-    def __init__(self):
-        self.data = None
-        self.lock = threading.Lock()
-
-    def GetData(self):
-        with self.lock:
-            return self.data
-
-    def SetData(self, data):
-        with self.lock:
-            self.data = data
-
 class G1_29_ArmController:
-    def __init__(self, motion_mode = False, simulation_mode = False):
+    def __init__(self, motion_mode = False, simulation_mode = False, event_driven = False, state_queue_depth = 1,
+                 ctrl_scheduler = None, instrument = True, ingest_domain_id = None, ingest_interface = None,
+                 topic_prefix = "", collision_guard = None, dedup_state = True, domain_id = None):
         logger_mp.info("Initialize G1_29_ArmController...")
-        self.q_target = np.zeros(14)
-        self.tauff_target = np.zeros(14)
+        # lowcmd is published on the domain this process joined (domain_id, as given to
+        # ChannelFactoryInitialize): state ingested from another domain would pair one robot's
+        # state with commands sent to whatever robot listens on this one
+        if ingest_domain_id is not None and ingest_domain_id != domain_id:
+            raise ValueError(f"ingest_domain_id {ingest_domain_id} differs from the process domain {domain_id}: "
+                             f"lowcmd cannot be published on the ingest domain")
+        self.topic_prefix = topic_prefix  # prepended to every DDS topic
+        # latency histograms (publish period, crc, dds write, state age, getter cost); None disables them
+        self.metrics = ControllerMetrics(f"{topic_prefix}G1_29_ArmController") if instrument else None
+        # latest arm target from ctrl_dual_arm, copied into a triple buffer so writers never block the publish loop
+        self.command = CommandSlot(14)
+        self.command_timeout = 0.5  # seconds without a new command before the producer is reported as stalled
+        self.command_stale = False
+        # optional self_collision.SelfCollisionGuard screening every target given to ctrl_dual_arm(_trajectory)
+        self.collision_guard = collision_guard
+        self.collision_rejections = 0
+        self._target_colliding = False
+        self.max_state_age = 0.1  # seconds; older lowstate stops the arm target from moving (see _ctrl_step)
+        self.state_stale = False
+        self._arm_q_target = np.zeros(14)
+        self._arm_tauff_target = np.zeros(14)
         self.motion_mode = motion_mode
         self.simulation_mode = simulation_mode
         self.kp_high = 300.0
@@ -95,32 +102,57 @@ class G1_29_ArmController:
         self.all_motor_q = None
         self.arm_velocity_limit = 20.0
         self.control_dt = 1.0 / 250.0
+        # absolute-deadline pacing of the publish loop; pass a PeriodicScheduler to set busy-wait, cpu or rt priority
+        self.ctrl_scheduler = ctrl_scheduler if ctrl_scheduler is not None else PeriodicScheduler(self.control_dt)
 
-        self._speed_gradual_max = False
-        self._gradual_start_time = None
-        self._gradual_time = None
+        # go home, speed ramps: stepped by the publish thread, each completing a Future
+        self.primitives = PrimitiveRunner(self)
 
         if self.motion_mode:
-            self.lowcmd_publisher = ChannelPublisher(kTopicLowCommand_Motion, hg_LowCmd)
+            self.lowcmd_publisher = ChannelPublisher(topic_prefix + kTopicLowCommand_Motion, hg_LowCmd)
         else:
-            self.lowcmd_publisher = ChannelPublisher(kTopicLowCommand_Debug, hg_LowCmd)
+            self.lowcmd_publisher = ChannelPublisher(topic_prefix + kTopicLowCommand_Debug, hg_LowCmd)
         self.lowcmd_publisher.Init()
-        self.lowstate_subscriber = ChannelSubscriber(kTopicLowState, hg_LowState)
-        self.lowstate_subscriber.Init()
-        self.lowstate_buffer = DataBuffer()
-
-        # initialize subscribe thread
-        self.subscribe_thread = threading.Thread(target=self._subscribe_motor_state)
-        self.subscribe_thread.daemon = True
-        self.subscribe_thread.start()
+        self.lowstate_subscriber = ChannelSubscriber(topic_prefix + kTopicLowState, hg_LowState)
+        self.ingest_process = None
+        if ingest_domain_id is not None:
+            # deserialize lowstate in a child process (same DDS domain) that writes into a shared-memory ring
+            self.ingest_process = IngestProcess("lowstate", topic_prefix + kTopicLowState, G1_29_Num_Motors,
+                                                domain_id = ingest_domain_id, network_interface = ingest_interface,
+                                                dedup = dedup_state)
+            self.lowstate_buffer = self.ingest_process.buffer
+        else:
+            # dedup_state = False publishes re-delivered samples too (see LowStateBuffer)
+            self.lowstate_buffer = LowStateBuffer(G1_29_Num_Motors, dedup = dedup_state)
+
+        # read-only views into every buffer slot, returned by the getters with view = True (no allocation)
+        arm_slice = slice(G1_29_JointArmIndex.kLeftShoulderPitch, G1_29_JointArmIndex.kRightWristYaw + 1)
+        self._arm_slice = arm_slice
+        self._motor_q_views = self.lowstate_buffer.views("q")
+        self._arm_q_views = self.lowstate_buffer.views("q", arm_slice)
+        self._arm_dq_views = self.lowstate_buffer.views("dq", arm_slice)
+        self._motor_names = [URDF_JOINT_MAP.get(id.name, id.name) for id in G1_29_JointIndex]
+
+        # initialize state ingestion: child process, DDS listener (event_driven) or polling thread
+        if self.ingest_process is not None:
+            self.subscribe_thread = None
+        elif event_driven:
+            self.lowstate_ingestor = SampleIngestor(self.lowstate_subscriber, self.lowstate_buffer.write,
+                                                    queue_depth = state_queue_depth, name = "lowstate_ingest")
+            self.lowstate_ingestor.start()
+            self.subscribe_thread = self.lowstate_ingestor.thread
+        else:
+            self.lowstate_subscriber.Init()
+            self.subscribe_thread = threading.Thread(target=self._subscribe_motor_state)
+            self.subscribe_thread.daemon = True
+            self.subscribe_thread.start()
 
-        while not self.lowstate_buffer.GetData():
+        while self.lowstate_buffer.seq == 0:
             time.sleep(0.1)
             logger_mp.warning("[G1_29_ArmController] Waiting to subscribe dds...")
         logger_mp.info("[G1_29_ArmController] Subscribe dds ok.")
 
         # initialize hg's lowcmd msg
-        self.crc = CRC()
         self.msg = unitree_hg_msg_dds__LowCmd_()
         self.msg.mode_pr = 0
         self.msg.mode_machine = self.get_mode_machine()
@@ -148,11 +180,17 @@ class G1_29_ArmController:
                     self.msg.motor_cmd[id].kp = self.kp_high
                     self.msg.motor_cmd[id].kd = self.kd_high
             self.msg.motor_cmd[id].q  = self.all_motor_q[id]
+        # packed mirror of self.msg: later writes go through it so the CRC never re-packs all 35 motors
+        self.encoder = LowCmdEncoder(self.msg, self._arm_slice)
+        self._arm_dq_target = np.zeros(14)
+        self._arm_q_command = self.encoder.motor["q"][self._arm_slice]
+        # time-stamped waypoints interpolated by the publish thread, see ctrl_dual_arm_trajectory
+        self.trajectory = ArmTrajectory(14)
+        self.lowcmd_listeners = []  # called as listener(monotonic stamp, crc) after each published LowCmd
         logger_mp.info("Lock OK!")
 
         # initialize publish thread
         self.publish_thread = threading.Thread(target=self._ctrl_motor_state)
-        self.ctrl_lock = threading.Lock()
         self.publish_thread.daemon = True
         self.publish_thread.start()
 
@@ -162,15 +200,11 @@ class G1_29_ArmController:
         while True:
             msg = self.lowstate_subscriber.Read()
             if msg is not None:
-                lowstate = G1_29_LowState()
-                for id in range(G1_29_Num_Motors):
-                    lowstate.motor_state[id].q  = msg.motor_state[id].q
-                    lowstate.motor_state[id].dq = msg.motor_state[id].dq
-                self.lowstate_buffer.SetData(lowstate)
+                self.lowstate_buffer.write(msg)
             time.sleep(0.002)
 
     def clip_arm_q_target(self, target_q, velocity_limit):
-        current_q = self.get_current_dual_arm_q()
+        current_q = self.get_current_dual_arm_q(view = True)
         delta = target_q - current_q
         motion_scale = np.max(np.abs(delta)) / (velocity_limit * self.control_dt)
         cliped_arm_q_target = current_q + delta / max(motion_scale, 1.0)
@@ -178,100 +212,204 @@ class G1_29_ArmController:
 
     def _ctrl_motor_state(self):
         if self.motion_mode:
-            self.msg.motor_cmd[G1_29_JointIndex.kNotUsedJoint0].q = 1.0;
+            self.encoder.set_motor(G1_29_JointIndex.kNotUsedJoint0, q = 1.0)
 
+        self.ctrl_scheduler.start()
+        last_start_time = None
         while True:
-            start_time = time.time()
-
-            with self.ctrl_lock:
-                arm_q_target     = self.q_target
-                arm_tauff_target = self.tauff_target
-
-            if self.simulation_mode:
-                cliped_arm_q_target = arm_q_target
-            else:
-                cliped_arm_q_target = self.clip_arm_q_target(arm_q_target, velocity_limit = self.arm_velocity_limit)
-
-            for idx, id in enumerate(G1_29_JointArmIndex):
-                self.msg.motor_cmd[id].q = cliped_arm_q_target[idx]
-                self.msg.motor_cmd[id].dq = 0
-                self.msg.motor_cmd[id].tau = arm_tauff_target[idx]
-
-            self.msg.crc = self.crc.Crc(self.msg)
-            self.lowcmd_publisher.Write(self.msg)
-
-            if self._speed_gradual_max is True:
-                t_elapsed = start_time - self._gradual_start_time
-                self.arm_velocity_limit = 20.0 + (10.0 * min(1.0, t_elapsed / 5.0))
-
-            current_time = time.time()
-            all_t_elapsed = current_time - start_time
-            sleep_time = max(0, (self.control_dt - all_t_elapsed))
-            time.sleep(sleep_time)
+            start_time = self.ctrl_scheduler.wait()
+            metrics = self.metrics
+            if metrics is not None and last_start_time is not None:
+                metrics.record_seconds("publish_period", start_time - last_start_time)
+            last_start_time = start_time
+
+            self._ctrl_step(start_time)
+            if metrics is not None:
+                metrics.record_seconds("cycle", time.monotonic() - start_time)
             # logger_mp.debug(f"arm_velocity_limit:{self.arm_velocity_limit}")
-            # logger_mp.debug(f"sleep_time:{sleep_time}")
+            # logger_mp.debug(f"lateness:{self.ctrl_scheduler.last_lateness}")
+
+    def _ctrl_step(self, start_time):
+        '''One publish cycle: clip the arm target, encode the LowCmd, compute its CRC and write it.'''
+        metrics = self.metrics
+        self.primitives.step(start_time)
+
+        command = self.command
+        command_stamp = command.snapshot(self._arm_q_target, self._arm_tauff_target)
+        arm_q_target     = self._arm_q_target
+        arm_tauff_target = self._arm_tauff_target
+        arm_dq_target    = self._arm_dq_target
+
+        trajectory = self.trajectory
+        if trajectory.sample(start_time, self._arm_q_command, arm_dq_target, arm_tauff_target):
+            arm_q_target     = trajectory.q_out
+            arm_dq_target    = trajectory.dq_out
+            arm_tauff_target = trajectory.tau_out
+        elif command.seq:
+            command_age = start_time - command_stamp
+            if metrics is not None:
+                metrics.record_seconds("command_age", command_age)
+            stale = command_age > self.command_timeout
+            if stale != self.command_stale:
+                self.command_stale = stale
+                if stale:
+                    logger_mp.warning(f"[G1_29_ArmController] no arm command for {command_age:.2f} s, holding the last target")
+
+        if self.simulation_mode:
+            self.encoder.set_arm(arm_q_target, arm_dq_target, arm_tauff_target)
+        else:
+            # clipping is relative to the measured q: with stale feedback keep re-sending the last command
+            state_stale = self.lowstate_buffer.age(start_time) > self.max_state_age
+            if state_stale != self.state_stale:
+                self.state_stale = state_stale
+                if state_stale:
+                    logger_mp.warning(f"[G1_29_ArmController] lowstate older than {self.max_state_age:.3f} s, holding the arm command")
+                else:
+                    logger_mp.info("[G1_29_ArmController] lowstate fresh again, resuming the arm command")
+            if not state_stale:
+                cliped_arm_q_target = self.clip_arm_q_target(arm_q_target, velocity_limit = self.arm_velocity_limit)
+                self.encoder.set_arm(cliped_arm_q_target, arm_dq_target, arm_tauff_target)
+
+        t0 = time.perf_counter_ns()
+        crc = self.encoder.crc()
+        self.msg.crc = crc
+        t1 = time.perf_counter_ns()
+        self.lowcmd_publisher.Write(self.msg)
+        if metrics is not None:
+            metrics.record("crc", t1 - t0)
+            metrics.record("dds_write", time.perf_counter_ns() - t1)
+        if self.lowcmd_listeners:
+            stamp = time.monotonic()
+            for listener in self.lowcmd_listeners:
+                listener(stamp, crc)
+
+    def _screen_targets(self, q_targets):
+        '''Return True when no arm target in ``q_targets`` is reported colliding by the collision guard.'''
+        guard = self.collision_guard
+        if guard is None:
+            return True
+        # held across the checks so a concurrent caller cannot interleave its own poses (or rejection count)
+        with guard.lock:
+            for q_target in q_targets:
+                if not guard.check(q_target):
+                    self.collision_rejections += 1
+                    if not self._target_colliding:
+                        logger_mp.warning(f"[G1_29_ArmController] arm target rejected, capsules too close: {guard.colliding_pairs()}")
+                    self._target_colliding = True
+                    return False
+            self._target_colliding = False
+            return True
 
     def ctrl_dual_arm(self, q_target, tauff_target):
-        '''Set control target values q & tau of the left and right arm motors.'''
-        with self.ctrl_lock:
-            self.q_target = q_target
-            self.tauff_target = tauff_target
+        '''Set control target values q & tau of the left and right arm motors.
+
+        With a ``collision_guard`` (screening runs in the caller's thread) a colliding target is
+        dropped, the previous command is kept and False is returned.'''
+        if not self._screen_targets((q_target,)):
+            return False
+        # new target first: a tick in between keeps following the trajectory instead of the old target
+        self.command.write(q_target, tauff_target)
+        self.trajectory.cancel()
+        return True
+
+    def ctrl_dual_arm_trajectory(self, times, q_target, dq_target = None, tauff_target = None, interpolation = "cubic"):
+        '''Queue arm waypoints (shape (n, 14)) to reach at ``time.monotonic()`` stamps ``times``.
+
+        The publish thread interpolates them (``"cubic"`` or ``"quintic"``) at every control tick,
+        sending the interpolated velocity as dq, and holds the last waypoint until ``ctrl_dual_arm``
+        or ``ctrl_dual_arm_go_home`` is called. A new batch replaces the queued waypoints from its
+        first stamp on. With a ``collision_guard`` a batch with a colliding waypoint is dropped
+        and False is returned; the interpolation between waypoints is not screened.'''
+        if not self._screen_targets(np.reshape(q_target, (-1, 14))):
+            return False
+        self.trajectory.push(times, q_target, dq_target, tauff_target, interpolation)
+        return True
+
+    def _latest_slot(self, max_age = None):
+        '''Return the lowstate buffer slot to read, recording the sample age when instrumented and checking ``max_age``.'''
+        buffer = self.lowstate_buffer
+        slot = buffer.latest_slot()
+        if self.metrics is not None or max_age is not None:
+            age = time.monotonic() - buffer.stamp[slot]
+            if self.metrics is not None:
+                self.metrics.record_seconds("state_age", age)
+            if max_age is not None:
+                buffer.check_age(max_age)
+        return slot
+
+    def state_stats(self):
+        '''Return the lowstate stream counters: received, age, rate, tick gaps, missed, repeats, resets.'''
+        return self.lowstate_buffer.stats()
 
     def get_mode_machine(self):
         '''Return current dds mode machine.'''
-        return self.lowstate_subscriber.Read().mode_machine
-
-    def get_current_motor_q(self):
-        '''Return current state q of all body motors.'''
-        return np.array([self.lowstate_buffer.GetData().motor_state[id].q for id in G1_29_JointIndex])
-
-    def get_motor_states(self):
+        buffer = self.lowstate_buffer
+        return int(buffer.mode_machine[buffer.latest_slot()])
+
+    @timed("get_current_motor_q")
+    def get_current_motor_q(self, out = None, max_age = None, view = False):
+        '''Return current state q of all body motors, copied into ``out`` or a new array.
+
+        ``view = True`` returns a read-only view of the latest buffer slot instead, without
+        copying; it is overwritten a few samples later, so use it right away. With ``max_age`` a
+        sample older than that many seconds raises buffers.StaleStateError.'''
+        slot = self._latest_slot(max_age)
+        if view:
+            return self._motor_q_views[slot]
+        out = np.empty(G1_29_Num_Motors) if out is None else out
+        self.lowstate_buffer.read("q", out)
+        return out
+
+    @timed("get_motor_states")
+    def get_motor_states(self, max_age = None):
         '''Return a dict of name and current position'''
-        motor_states = {}
-        for id in G1_29_JointIndex:
-            joint_name = URDF_JOINT_MAP.get(id.name, id.name)
-            motor_states[joint_name] = self.lowstate_buffer.GetData().motor_state[id].q
-        return motor_states
-
-
-    def get_current_dual_arm_q(self):
-        '''Return current state q of the left and right arm motors.'''
-        return np.array([self.lowstate_buffer.GetData().motor_state[id].q for id in G1_29_JointArmIndex])
-
-    def get_current_dual_arm_dq(self):
-        '''Return current state dq of the left and right arm motors.'''
-        return np.array([self.lowstate_buffer.GetData().motor_state[id].dq for id in G1_29_JointArmIndex])
+        q = self._motor_q_views[self._latest_slot(max_age)]
+        return dict(zip(self._motor_names, q.tolist()))
+
+    @timed("get_current_dual_arm_q")
+    def get_current_dual_arm_q(self, out = None, max_age = None, view = False):
+        '''Return current state q of the left and right arm motors (copy, or slot view with ``view``, as above).'''
+        slot = self._latest_slot(max_age)
+        if view:
+            return self._arm_q_views[slot]
+        out = np.empty(14) if out is None else out
+        self.lowstate_buffer.read("q", out, self._arm_slice)
+        return out
+
+    @timed("get_current_dual_arm_dq")
+    def get_current_dual_arm_dq(self, out = None, max_age = None, view = False):
+        '''Return current state dq of the left and right arm motors (copy, or slot view with ``view``, as above).'''
+        slot = self._latest_slot(max_age)
+        if view:
+            return self._arm_dq_views[slot]
+        out = np.empty(14) if out is None else out
+        self.lowstate_buffer.read("dq", out, self._arm_slice)
+        return out
+
+    def run_primitive(self, primitive):
+        '''Start a MotionPrimitive in the publish thread; returns its concurrent.futures.Future.'''
+        return self.primitives.submit(primitive)
+
+    def go_home(self, tolerance = 0.05, timeout = 5.0):
+        '''Non-blocking ``ctrl_dual_arm_go_home``: returns a Future resolving to True once home (False on timeout).
+
+        From asyncio, ``await asyncio.wrap_future(arm.go_home())``.'''
+        return self.run_primitive(GoHome(G1_29_JointIndex.kNotUsedJoint0, tolerance = tolerance, timeout = timeout))
 
     def ctrl_dual_arm_go_home(self):
         '''Move both the left and right arms of the robot to their home position by setting the target joint angles (q) and torques (tau) to zero.'''
-        logger_mp.info("[G1_29_ArmController] ctrl_dual_arm_go_home start...")
-        max_attempts = 100
-        current_attempts = 0
-        with self.ctrl_lock:
-            self.q_target = np.zeros(14)
-            # self.tauff_target = np.zeros(14)
-        tolerance = 0.05  # Tolerance threshold for joint angles to determine "close to zero", can be adjusted based on your motor's precision requirements
-        while current_attempts < max_attempts:
-            current_q = self.get_current_dual_arm_q()
-            if np.all(np.abs(current_q) < tolerance):
-                if self.motion_mode:
-                    for weight in np.linspace(1, 0, num=101):
-                        self.msg.motor_cmd[G1_29_JointIndex.kNotUsedJoint0].q = weight;
-                        time.sleep(0.02)
-                logger_mp.info("[G1_29_ArmController] both arms have reached the home position.")
-                break
-            current_attempts += 1
-            time.sleep(0.05)
+        return self.go_home().result()
 
     def speed_gradual_max(self, t = 5.0):
-        '''Parameter t is the total time required for arms velocity to gradually increase to its maximum value, in seconds. The default is 5.0.'''
-        self._gradual_start_time = time.time()
-        self._gradual_time = t
-        self._speed_gradual_max = True
+        '''Parameter t is the total time required for arms velocity to gradually increase to its maximum value, in seconds. The default is 5.0.
+
+        Returns a Future resolving to the final velocity limit when the ramp is done.'''
+        return self.run_primitive(SpeedRamp(t, start_limit = 20.0, end_limit = 30.0))
 
     def speed_instant_max(self):
         '''set arms velocity to the maximum value immediately, instead of gradually increasing.'''
         self.arm_velocity_limit = 30.0
+        return self.run_primitive(SpeedRamp(0.0, start_limit = 30.0, end_limit = 30.0))  # supersedes a running ramp
 
     def _Is_weak_motor(self, motor_index):
         weak_motors = [
@@ -372,13 +510,14 @@ class G1_29_JointIndex(IntEnum):
 
 
 if __name__ == "__main__":
-    from robot_arm_ik import G1_29_ArmIK, G1_23_ArmIK, H1_2_ArmIK, H1_ArmIK
+    from robot_arm_ik import G1_29_ArmIK
+    from self_collision import SelfCollisionGuard
     import pinocchio as pin
 
     ChannelFactoryInitialize(1) # 0 for real robot, 1 for simulation
 
-    arm_ik = G1_29_ArmIK(Unit_Test = True, Visualization = False)
-    arm = G1_29_ArmController(simulation_mode=True)
+    arm_ik = G1_29_ArmIK()
+    arm = G1_29_ArmController(simulation_mode=True, collision_guard = SelfCollisionGuard())
     # arm_ik = G1_23_ArmIK(Unit_Test = True, Visualization = False)
     # arm = G1_23_ArmController()
     # arm_ik = H1_2_ArmIK(Unit_Test = True, Visualization = False)
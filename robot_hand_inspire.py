@@ -5,12 +5,16 @@ import numpy as np
 from enum import IntEnum
 import threading
 import time
-from multiprocessing import Process, Array
 from dataclasses import dataclass
 import cyclonedds.idl as idl
 import cyclonedds.idl.annotations as annotate
 import cyclonedds.idl.types as types
 
+from dds_ingest import SampleIngestor
+from instrumentation import ControllerMetrics, timed
+from buffers import HandStateBuffer, InspireStateBuffer
+from shm_ingest import IngestProcess
+
 Inspire_Num_Motors = 6
 
 @dataclass
@@ -57,64 +61,225 @@ URDF_JOINT_MAP = {
     }
 
 class Inspire_Controller_DFX:
-    def __init__(self, fps = 100.0, Unit_Test = False, simulation_mode = False):
+    def __init__(self, fps = 100.0, Unit_Test = False, simulation_mode = False, event_driven = False, state_queue_depth = 1,
+                 instrument = True, ingest_domain_id = None, ingest_interface = None, topic_prefix = ""):
         logger_mp.info("Initialize Inspire_Controller_DFX...")
+        self.topic_prefix = topic_prefix  # prepended to every DDS topic
+        # latency histograms (state age, get_state cost); None disables them
+        self.metrics = ControllerMetrics(f"{topic_prefix}Inspire_Controller_DFX") if instrument else None
         self.fps = fps
         self.Unit_Test = Unit_Test
         self.simulation_mode = simulation_mode
 
 
-        self.HandState_subscriber = ChannelSubscriber(kTopicInspireDFXState, MotorStates_)
-        self.HandState_subscriber.Init()
+        self.HandState_subscriber = ChannelSubscriber(topic_prefix + kTopicInspireDFXState, MotorStates_)
+
+        # hand states of both hands in message order (right 0-5, left 6-11), optionally filled by a child process
+        self.ingest_process = None
+        if ingest_domain_id is not None:
+            self.ingest_process = IngestProcess("hand_state", topic_prefix + kTopicInspireDFXState, 2 * Inspire_Num_Motors,
+                                                domain_id = ingest_domain_id, network_interface = ingest_interface)
+            self.hand_state_buffer = self.ingest_process.buffer
+        else:
+            self.hand_state_buffer = HandStateBuffer(2 * Inspire_Num_Motors)
+        self.state_buffers = (self.hand_state_buffer,)
 
-        # Shared Arrays for hand states
-        self.left_hand_state_array  = Array('d', Inspire_Num_Motors, lock=True)
-        self.right_hand_state_array = Array('d', Inspire_Num_Motors, lock=True)
+        # normalization of get_state_array: (max - q) / (max - min), per joint in message order
+        hand_min = np.array([0.0, 0.0, 0.0, 0.0, 0.0, -0.1])
+        hand_max = np.array([1.7, 1.7, 1.7, 1.7, 0.5, 1.3])
+        self._norm_max = np.tile(hand_max, 2)
+        self._norm_inv_range = 1.0 / np.tile(hand_max - hand_min, 2)
+        self._state_array = np.zeros(2 * Inspire_Num_Motors)  # scratch of get_state
+        self.state_names = [URDF_JOINT_MAP.get(id.name, id.name)
+                            for id in (*Inspire_Right_Hand_JointIndex, *Inspire_Left_Hand_JointIndex)]
 
-        # initialize subscribe thread
-        self.subscribe_state_thread = threading.Thread(target=self._subscribe_hand_state)
-        self.subscribe_state_thread.daemon = True
-        self.subscribe_state_thread.start()
+        # initialize state ingestion: child process, DDS listener (event_driven) or polling thread
+        if self.ingest_process is not None:
+            self.subscribe_state_thread = None
+        elif event_driven:
+            self.hand_state_ingestor = SampleIngestor(self.HandState_subscriber, self._on_hand_state,
+                                                      queue_depth = state_queue_depth, name = "hand_state_ingest")
+            self.hand_state_ingestor.start()
+            self.subscribe_state_thread = self.hand_state_ingestor.thread
+        else:
+            self.HandState_subscriber.Init()
+            self.subscribe_state_thread = threading.Thread(target=self._subscribe_hand_state)
+            self.subscribe_state_thread.daemon = True
+            self.subscribe_state_thread.start()
 
     def _subscribe_hand_state(self):
         while True:
             hand_msg  = self.HandState_subscriber.Read()
             if hand_msg is not None:
-                for idx, id in enumerate(Inspire_Left_Hand_JointIndex):
-                    self.left_hand_state_array[idx] = hand_msg.states[id].q
-                for idx, id in enumerate(Inspire_Right_Hand_JointIndex):
-                    self.right_hand_state_array[idx] = hand_msg.states[id].q
+                self._on_hand_state(hand_msg)
             time.sleep(0.002)
 
-    def get_state(self):
-        out = {}
-        def put(enum_item, value):
-            ctrl_name = enum_item.name
-
-            key = URDF_JOINT_MAP.get(ctrl_name, ctrl_name)  # fallback
-            out[key] = float(value)
-
-        left = np.array(self.left_hand_state_array)
-        right = np.array(self.right_hand_state_array)
-
-        def normalize(val, min_val, max_val):
-            return np.clip((max_val - val) / (max_val - min_val), 0.0, 1.0)
-
-        for idx in range(Inspire_Num_Motors):
-            if idx <= 3:
-                left[idx]  = normalize(left[idx], 0.0, 1.7)
-                right[idx] = normalize(right[idx], 0.0, 1.7)
-            elif idx == 4:
-                left[idx]  = normalize(left[idx], 0.0, 0.5)
-                right[idx] = normalize(right[idx], 0.0, 0.5)
-            elif idx == 5:
-                left[idx]  = normalize(left[idx], -0.1, 1.3)
-                right[idx] = normalize(right[idx], -0.1, 1.3)
-            put(Inspire_Right_Hand_JointIndex(idx), right[idx])
-            put(Inspire_Left_Hand_JointIndex(idx+6), left[idx])
+    def _on_hand_state(self, hand_msg):
+        self.hand_state_buffer.write(hand_msg)
 
+    @timed("get_state_array")
+    def get_state_array(self, out = None, max_age = None):
+        '''Return the 12 hand states normalized to [0, 1], in message order.
+
+        The order is right pinky, ring, middle, index, thumb-bend, thumb-rotation, then the same six
+        for the left hand (see the table below and ``state_names``). The result is written into ``out``
+        or a new array. With ``max_age`` a sample older than that many seconds raises
+        buffers.StaleStateError.'''
+        buffer = self.hand_state_buffer
+        slot = buffer.latest_slot()
+        if self.metrics is not None:
+            self.metrics.record_seconds("state_age", time.monotonic() - buffer.stamp[slot])
+        if max_age is not None:
+            buffer.check_age(max_age)
+        out = np.empty(2 * Inspire_Num_Motors) if out is None else out
+        np.subtract(self._norm_max, buffer.q[slot], out=out)
+        out *= self._norm_inv_range
+        np.clip(out, 0.0, 1.0, out=out)
         return out
 
+    @timed("get_state")
+    def get_state(self, max_age = None):
+        '''Return a dict of URDF joint name and normalized hand state.'''
+        return dict(zip(self.state_names, self.get_state_array(self._state_array, max_age).tolist()))
+
+    def state_stats(self):
+        '''Return the hand state stream counters: received, age and rate.'''
+        return self.hand_state_buffer.stats()
+
+
+class Inspire_Controller_FTP:
+    '''State of both Inspire FTP hands, one inspire_hand_state topic per hand.
+
+    Every message is decoded in one NumPy assignment into an InspireStateBuffer per hand (all
+    seven sequences). The getters gather both hands in the DFX message order (right 0-5, left
+    6-11, see ``state_names``): ``get_state_array`` returns the angles normalized to [0, 1]
+    (1 = open, like Inspire_Controller_DFX), ``get_position_array``, ``get_force_array`` and
+    ``get_current_array`` the raw pos_act, force_act and current values; each has a dict
+    counterpart keyed by ``state_names``. With ``max_age`` a getter raises
+    buffers.StaleStateError when a hand's latest sample is older than that many seconds.
+    '''
+    def __init__(self, event_driven = False, state_queue_depth = 1, instrument = True, ingest_domain_id = None,
+                 ingest_interface = None, topic_prefix = ""):
+        logger_mp.info("Initialize Inspire_Controller_FTP...")
+        self.topic_prefix = topic_prefix  # prepended to every DDS topic
+        # latency histograms (state age, getter cost); None disables them
+        self.metrics = ControllerMetrics(f"{topic_prefix}Inspire_Controller_FTP") if instrument else None
+
+        topics = {"right": topic_prefix + kTopicInspireFTPRightState, "left": topic_prefix + kTopicInspireFTPLeftState}
+        self.ingest_processes = {}
+        self.hand_state_buffers = {}
+        for side, topic in topics.items():
+            if ingest_domain_id is not None:
+                process = IngestProcess("inspire_state", topic, Inspire_Num_Motors,
+                                        domain_id = ingest_domain_id, network_interface = ingest_interface)
+                self.ingest_processes[side] = process
+                self.hand_state_buffers[side] = process.buffer
+            else:
+                self.hand_state_buffers[side] = InspireStateBuffer(Inspire_Num_Motors)
+        # message order of the gathered arrays: right hand, then left hand
+        self.state_buffers = (self.hand_state_buffers["right"], self.hand_state_buffers["left"])
+
+        self._arrays = {name: np.zeros(2 * Inspire_Num_Motors)  # scratch of the dict getters
+                        for name in ("angle_act", "pos_act", "force_act", "current")}
+        self.state_names = [URDF_JOINT_MAP.get(id.name, id.name)
+                            for id in (*Inspire_Right_Hand_JointIndex, *Inspire_Left_Hand_JointIndex)]
+
+        # initialize state ingestion: child processes, DDS listeners (event_driven) or one polling thread
+        self.subscribers = {}
+        self.hand_state_ingestors = {}
+        if ingest_domain_id is not None:
+            self.subscribe_state_thread = None
+            return
+        for side, topic in topics.items():
+            self.subscribers[side] = ChannelSubscriber(topic, inspire_hand_state)
+        if event_driven:
+            for side, subscriber in self.subscribers.items():
+                ingestor = SampleIngestor(subscriber, self.hand_state_buffers[side].write,
+                                          queue_depth = state_queue_depth, name = f"{side}_inspire_state_ingest")
+                ingestor.start()
+                self.hand_state_ingestors[side] = ingestor
+            self.subscribe_state_thread = None
+        else:
+            for subscriber in self.subscribers.values():
+                subscriber.Init()
+            self.subscribe_state_thread = threading.Thread(target=self._subscribe_hand_state)
+            self.subscribe_state_thread.daemon = True
+            self.subscribe_state_thread.start()
+
+    def _subscribe_hand_state(self):
+        while True:
+            for side, subscriber in self.subscribers.items():
+                hand_msg = subscriber.Read()
+                if hand_msg is not None:
+                    self.hand_state_buffers[side].write(hand_msg)
+            time.sleep(0.002)
+
+    def _gather(self, name, out, max_age):
+        '''Copy row ``name`` of the latest sample of each hand into ``out`` (right, then left).'''
+        row = InspireStateBuffer.row(name)
+        out = np.empty(2 * Inspire_Num_Motors) if out is None else out
+        now = time.monotonic()
+        for k, buffer in enumerate(self.state_buffers):
+            slot = buffer.latest_slot()
+            if self.metrics is not None:
+                self.metrics.record_seconds("state_age", now - buffer.stamp[slot])
+            if max_age is not None:
+                buffer.check_age(max_age, now)
+            out[k * Inspire_Num_Motors:(k + 1) * Inspire_Num_Motors] = buffer.state[slot, row]
+        return out
+
+    @timed("get_state_array")
+    def get_state_array(self, out = None, max_age = None):
+        '''Return the 12 finger angles normalized to [0, 1] (angle_act / 1000), in message order.
+
+        The result is written into ``out`` or a new array.'''
+        out = self._gather("angle_act", out, max_age)
+        out *= 1.0 / 1000.0
+        np.clip(out, 0.0, 1.0, out=out)
+        return out
+
+    @timed("get_position_array")
+    def get_position_array(self, out = None, max_age = None):
+        '''Return the 12 raw actuator positions (pos_act), in message order.'''
+        return self._gather("pos_act", out, max_age)
+
+    @timed("get_force_array")
+    def get_force_array(self, out = None, max_age = None):
+        '''Return the 12 raw finger forces (force_act), in message order.'''
+        return self._gather("force_act", out, max_age)
+
+    @timed("get_current_array")
+    def get_current_array(self, out = None, max_age = None):
+        '''Return the 12 raw actuator currents, in message order.'''
+        return self._gather("current", out, max_age)
+
+    @timed("get_state")
+    def get_state(self, max_age = None):
+        '''Return a dict of URDF joint name and normalized finger angle.'''
+        return dict(zip(self.state_names, self.get_state_array(self._arrays["angle_act"], max_age).tolist()))
+
+    def get_position(self, max_age = None):
+        '''Return a dict of URDF joint name and raw actuator position.'''
+        return dict(zip(self.state_names, self.get_position_array(self._arrays["pos_act"], max_age).tolist()))
+
+    def get_force(self, max_age = None):
+        '''Return a dict of URDF joint name and raw finger force.'''
+        return dict(zip(self.state_names, self.get_force_array(self._arrays["force_act"], max_age).tolist()))
+
+    def get_current(self, max_age = None):
+        '''Return a dict of URDF joint name and raw actuator current.'''
+        return dict(zip(self.state_names, self.get_current_array(self._arrays["current"], max_age).tolist()))
+
+    def get_errors(self):
+        '''Return the latest err, status and temperature rows of each hand (uint8 values), keyed by side.'''
+        rows = [InspireStateBuffer.row(name) for name in ("err", "status", "temperature")]
+        return {side: dict(zip(("err", "status", "temperature"), buffer.state[buffer.latest_slot(), rows].tolist()))
+                for side, buffer in self.hand_state_buffers.items()}
+
+    def state_stats(self):
+        '''Return the state stream counters (received, age, rate) of each hand, keyed by side.'''
+        return {side: buffer.stats() for side, buffer in self.hand_state_buffers.items()}
+
 # Update hand state, according to the official documentation:
 # 1. https://support.unitree.com/home/en/G1_developer/inspire_dfx_dexterous_hand
 # 2. https://support.unitree.com/home/en/G1_developer/inspire_ftp_dexterity_hand
@@ -0,0 +1,82 @@
+import math
+import os
+import time
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+
+class PeriodicScheduler:
+    '''Drift-free periodic timing for a control loop, on the monotonic clock.
+
+    Deadlines are absolute (``start + k * period``), so sleep overshoot does not accumulate.
+    ``busy_wait`` seconds before each deadline are spun instead of slept for tighter wakeups.
+    When a cycle overruns by more than a period, ``missed = "skip"`` drops the missed
+    deadlines and waits for the next future one on the grid, while ``"catchup"`` runs them back
+    to back. ``missed`` counts the dropped deadlines (skip) or, for catchup, every deadline that
+    ran a period or more late, each counted once.
+    ``cpu`` and ``rt_priority`` are applied to the calling thread in ``start`` when permitted.
+    '''
+    def __init__(self, period, busy_wait = 0.0, missed = "skip", cpu = None, rt_priority = None):
+        assert missed in ("skip", "catchup"), f"unknown missed-cycle policy: {missed}"
+        self.period = period
+        self.busy_wait = busy_wait
+        self.missed_policy = missed
+        self.cpu = cpu
+        self.rt_priority = rt_priority
+
+        self.deadline = None
+        self.cycles = 0
+        self.missed = 0
+        self._backlog_end = -math.inf  # last late deadline already counted in catchup mode
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def start(self):
+        '''Apply affinity / priority to the calling thread and anchor the deadline grid at now.'''
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except (AttributeError, OSError) as e:
+                logger_mp.warning(f"[PeriodicScheduler] cannot pin thread to cpu {self.cpu}: {e}")
+        if self.rt_priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.rt_priority))
+            except (AttributeError, OSError) as e:
+                logger_mp.warning(f"[PeriodicScheduler] cannot set SCHED_FIFO priority {self.rt_priority}: {e}")
+        self.deadline = time.monotonic()
+
+    def wait(self):
+        '''Block until the next deadline and return it (monotonic seconds).'''
+        if self.deadline is None:
+            self.start()
+            return self.deadline
+
+        self.deadline += self.period
+        now = time.monotonic()
+        if now - self.deadline >= self.period:
+            behind = math.floor((now - self.deadline) / self.period)
+            if self.missed_policy == "skip":
+                # this deadline and the ``behind`` after it are all past
+                self.missed += behind + 1
+                self.deadline += (behind + 1) * self.period
+            else:
+                # the calls working through a backlog see it again: count only deadlines not counted yet
+                end = self.deadline + (behind - 1) * self.period
+                counted = max(self._backlog_end, self.deadline - self.period)
+                new = round((end - counted) / self.period)
+                if new > 0:
+                    self.missed += new
+                    self._backlog_end = end
+
+        remaining = self.deadline - now - self.busy_wait
+        if remaining > 0:
+            time.sleep(remaining)
+        while time.monotonic() < self.deadline:
+            pass
+
+        self.cycles += 1
+        self.last_lateness = time.monotonic() - self.deadline
+        if self.last_lateness > self.max_lateness:
+            self.max_lateness = self.last_lateness
+        return self.deadline
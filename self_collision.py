@@ -0,0 +1,232 @@
+import threading
+import time
+import numpy as np
+
+from instrumentation import LatencyHistogram
+from robot_arm_ik import URDF_PATH, build_arm_model
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+HAND_LENGTH = 0.2      # wrist yaw joint to finger tips of the Inspire hand, m
+UPPER_ARM_RADIUS = 0.05
+FOREARM_RADIUS = 0.04
+HAND_RADIUS = 0.045
+TORSO_RADIUS = 0.08
+PELVIS_RADIUS = 0.06
+
+
+class SelfCollisionGuard:
+    '''Capsule screening of arm configurations against each other, the torso and the pelvis.
+
+    Every arm link group of the ``g1.urdf`` arm sub-model (robot_arm_ik.build_arm_model) is
+    approximated by a capsule fixed in one of its frames: the upper arm (shoulder to elbow),
+    the forearm (elbow to wrist) and the hand (wrist to finger tips). Torso and pelvis are
+    capsules fixed in their own frames, which do not move in the sub-model. The segments are
+    computed once from the kinematics at neutral, so no meshes are needed.
+
+    ``check(q)`` runs forward kinematics of the 14 arm joints, updates only the capsule frames
+    and evaluates the segment-segment distances of all screened pairs at once with NumPy
+    (left against right arm, forearms and hands against torso and pelvis; adjacent links are
+    not screened). A configuration is clear when every distance exceeds the sum of the radii
+    plus ``margin``. The cost is recorded in ``check_time``; see ``stats()``.
+
+    The pinocchio Data and the scratch arrays are shared, so ``check`` holds ``lock``; hold it
+    across ``check`` and ``colliding_pairs`` to read the pairs of that same check.
+    '''
+    def __init__(self, urdf_path = URDF_PATH, margin = 0.01):
+        import pinocchio as pin
+        self._pin = pin
+        self.model = build_arm_model(urdf_path)
+        self.data = self.model.createData()
+        self.margin = margin
+
+        q0 = pin.neutral(self.model)
+        pin.framesForwardKinematics(self.model, self.data, q0)
+
+        def origin(frame):
+            return self.data.oMf[self.model.getFrameId(frame)].translation.copy()
+
+        capsules = []  # (name, frame, start, end, radius) with the end points in world coordinates at neutral
+        for side, hand in (("left", "L"), ("right", "R")):
+            wrist = origin(f"{side}_wrist_yaw_link")
+            hand_base = origin(f"{hand}_hand_base_link")
+            tip = wrist + HAND_LENGTH * (hand_base - wrist) / np.linalg.norm(hand_base - wrist)
+            capsules += [
+                (f"{side}_upper_arm", f"{side}_shoulder_yaw_link", origin(f"{side}_shoulder_roll_link"),
+                 origin(f"{side}_elbow_link"), UPPER_ARM_RADIUS),
+                (f"{side}_forearm", f"{side}_elbow_link", origin(f"{side}_elbow_link"),
+                 origin(f"{side}_wrist_pitch_link"), FOREARM_RADIUS),
+                (f"{side}_hand", f"{side}_wrist_yaw_link", wrist, tip, HAND_RADIUS),
+            ]
+        capsules += [
+            ("torso", "torso_link", np.array([0.0, 0.0, 0.12]), np.array([0.0, 0.0, 0.30]), TORSO_RADIUS),
+            ("pelvis", "pelvis", np.array([0.0, -0.02, -0.02]), np.array([0.0, 0.02, -0.02]), PELVIS_RADIUS),
+        ]
+
+        self.names = [name for name, *_ in capsules]
+        frames = []
+        self._capsule_frame = []  # index into frame_ids of every capsule
+        self._local = np.zeros((len(capsules), 2, 3))  # segment end points in the capsule frame
+        self.radius = np.zeros(len(capsules))
+        for k, (name, frame, start, end, radius) in enumerate(capsules):
+            if frame not in frames:
+                frames.append(frame)
+            self._capsule_frame.append(frames.index(frame))
+            oMf = self.data.oMf[self.model.getFrameId(frame)]
+            self._local[k] = [oMf.actInv(start), oMf.actInv(end)]
+            self.radius[k] = radius
+        self.frame_ids = [self.model.getFrameId(frame) for frame in frames]
+        self._capsule_frame = np.array(self._capsule_frame)
+
+        index = {name: k for k, name in enumerate(self.names)}
+        pairs = []
+        for left in ("left_upper_arm", "left_forearm", "left_hand"):
+            for right in ("right_upper_arm", "right_forearm", "right_hand"):
+                pairs.append((left, right))
+        for side in ("left", "right"):
+            for link in ("forearm", "hand"):
+                for body in ("torso", "pelvis"):
+                    pairs.append((f"{side}_{link}", body))
+        self.pairs = pairs
+        self._first = np.array([index[a] for a, _ in pairs])
+        self._second = np.array([index[b] for _, b in pairs])
+        self._clearance = self.radius[self._first] + self.radius[self._second]
+
+        self._rotations = np.zeros((len(frames), 3, 3))
+        self._translations = np.zeros((len(frames), 3))
+        self.distances = np.zeros(len(pairs))  # surface distances of the last check, negative when penetrating
+        self.lock = threading.RLock()
+        self.check_time = LatencyHistogram()
+        self.checks = 0
+        self.collisions = 0
+        if not self.check(q0):
+            logger_mp.warning(f"[SelfCollisionGuard] neutral configuration collides: {self.colliding_pairs()}")
+
+    def _segments(self, q):
+        pin = self._pin
+        pin.forwardKinematics(self.model, self.data, q)
+        for i, frame_id in enumerate(self.frame_ids):
+            oMf = pin.updateFramePlacement(self.model, self.data, frame_id)
+            self._rotations[i] = oMf.rotation
+            self._translations[i] = oMf.translation
+        rotations = self._rotations[self._capsule_frame]
+        points = np.einsum("kij,kpj->kpi", rotations, self._local)
+        points += self._translations[self._capsule_frame][:, None, :]
+        return points
+
+    def check(self, q):
+        '''Return True when the arm configuration ``q`` (14 joints) keeps every screened pair apart.'''
+        with self.lock:
+            start = time.perf_counter_ns()
+            points = self._segments(q)
+            np.subtract(_segment_distances(points[self._first], points[self._second]), self._clearance,
+                        out=self.distances)
+            clear = bool(np.all(self.distances > self.margin))
+            self.checks += 1
+            self.collisions += not clear
+            self.check_time.record(time.perf_counter_ns() - start)
+            return clear
+
+    def colliding_pairs(self):
+        '''Names of the pairs closer than ``margin`` in the last check.'''
+        with self.lock:
+            return [self.pairs[i] for i in np.flatnonzero(self.distances <= self.margin)]
+
+    def stats(self):
+        '''Return the check and collision counts, the last minimum distance and check-time percentiles.'''
+        return {
+            "checks": self.checks,
+            "collisions": self.collisions,
+            "min_distance": float(self.distances.min()),
+            "check": self.check_time.snapshot(),
+        }
+
+
+def _clamp01(x):
+    # np.clip costs several times more than this on arrays of a few elements
+    return np.minimum(np.maximum(x, 0.0), 1.0)
+
+
+def _segment_distances(first, second):
+    '''Closest distances between segments ``first[k]`` and ``second[k]`` (arrays of shape ``(n, 2, 3)``).'''
+    p1, p2 = first[:, 0], second[:, 0]
+    d1 = first[:, 1] - p1
+    d2 = second[:, 1] - p2
+    r = p1 - p2
+    a = np.einsum("ij,ij->i", d1, d1)
+    e = np.einsum("ij,ij->i", d2, d2)
+    b = np.einsum("ij,ij->i", d1, d2)
+    c = np.einsum("ij,ij->i", d1, r)
+    f = np.einsum("ij,ij->i", d2, r)
+    denom = a * e - b * b
+
+    # closest point parameters on the infinite lines, clamped to the segments (Ericson, 5.1.9)
+    parallel = denom < 1e-12
+    s = _clamp01((b * f - c * e) / np.where(parallel, 1.0, denom))
+    s[parallel] = 0.0
+    t = (b * s + f) / e
+    below, above = t < 0.0, t > 1.0
+    s = np.where(below, _clamp01(-c / a), np.where(above, _clamp01((b - c) / a), s))
+    t = _clamp01(t)
+    delta = (p1 + s[:, None] * d1) - (p2 + t[:, None] * d2)
+    return np.sqrt(np.einsum("ij,ij->i", delta, delta))
+
+
+def _arm_q(**joints):
+    '''Arm configuration (G1_29_ARM_JOINT_NAMES order) with the given joints set, e.g. ``left_elbow_joint = 0.5``.'''
+    from robot_arm_ik import G1_29_ARM_JOINT_NAMES
+    return np.array([joints.get(name, 0.0) for name in G1_29_ARM_JOINT_NAMES])
+
+
+# name -> (arm q, pair expected among the colliding ones, or None for a clear pose)
+KNOWN_POSES = {
+    "neutral": (_arm_q(), None),
+    "arms_spread": (_arm_q(left_shoulder_roll_joint = 0.8, right_shoulder_roll_joint = -0.8), None),
+    "arms_forward": (_arm_q(left_shoulder_pitch_joint = -1.2, right_shoulder_pitch_joint = -1.2,
+                            left_shoulder_roll_joint = 0.3, right_shoulder_roll_joint = -0.3,
+                            left_elbow_joint = 0.5, right_elbow_joint = 0.5), None),
+    "arms_crossed": (_arm_q(left_shoulder_pitch_joint = -1.2, right_shoulder_pitch_joint = -1.2,
+                            left_shoulder_roll_joint = -0.5, right_shoulder_roll_joint = 0.5,
+                            left_elbow_joint = 0.5, right_elbow_joint = 0.5), ("left_forearm", "right_forearm")),
+    "forearms_in_torso": (_arm_q(left_shoulder_pitch_joint = -0.3, right_shoulder_pitch_joint = -0.3,
+                                 left_shoulder_roll_joint = -0.3, right_shoulder_roll_joint = 0.3,
+                                 left_elbow_joint = 2.0, right_elbow_joint = 2.0), ("left_forearm", "torso")),
+}
+
+
+def check_known_poses(guard = None, checks = 5000):
+    '''Screen KNOWN_POSES and random configurations; return a list of failures (empty when fine).
+
+    Clear poses must pass, colliding ones must be rejected with their expected pair reported.
+    The random configurations only measure the cost per check.'''
+    guard = SelfCollisionGuard() if guard is None else guard
+    failures = []
+    for name, (q, pair) in KNOWN_POSES.items():
+        clear = guard.check(q)
+        pairs = guard.colliding_pairs()
+        print(f"{name}: {'clear' if clear else 'colliding'}, min distance {guard.distances.min():.3f} m")
+        if pair is None and not clear:
+            failures.append(f"{name} reported colliding: {pairs}")
+        elif pair is not None and (clear or pair not in pairs):
+            failures.append(f"{name} should report {pair}, got {pairs}")
+
+    rng = np.random.default_rng(0)
+    lower, upper = guard.model.lowerPositionLimit, guard.model.upperPositionLimit
+    for _ in range(checks):
+        guard.check(rng.uniform(lower, upper))
+    stats = guard.stats()
+    print(f"{stats['checks']} checks, {stats['collisions'] / stats['checks'] * 100:.1f}% colliding, "
+          f"check p50 {stats['check']['p50_us']:.1f}us p99 {stats['check']['p99_us']:.1f}us "
+          f"max {stats['check']['max_us']:.1f}us")
+    return failures
+
+
+if __name__ == "__main__":
+    # Known clear and colliding arm poses, then the cost per check; exit 1 when a pose is misjudged.
+    import sys
+
+    failures = check_known_poses()
+    for failure in failures:
+        print(f"SelfCollisionGuard: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,99 @@
+import argparse
+import atexit
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from buffers import LowStateBuffer, HandStateBuffer, InspireStateBuffer
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+# kind -> (buffer class, message module, message type name)
+STREAM_KINDS = {
+    "lowstate": (LowStateBuffer, "unitree_sdk2py.idl.unitree_hg.msg.dds_", "LowState_"),
+    "hand_state": (HandStateBuffer, "unitree_sdk2py.idl.unitree_go.msg.dds_", "MotorStates_"),
+    "inspire_state": (InspireStateBuffer, "robot_hand_inspire", "inspire_hand_state"),
+}
+
+
+class IngestProcess:
+    '''DDS state ingestion in a dedicated child process, publishing into a shared-memory ring.
+
+    The parent creates the shared-memory ``buffer`` (a ``SlotBuffer`` subclass, typically with
+    more slots than the in-process default) and starts ``python -m shm_ingest`` as a separate
+    interpreter, so deserialization never competes with the parent's GIL. The child joins the
+    same DDS domain, subscribes to ``topic`` with a listener and writes every sample, stamped
+    with ``time.monotonic()`` (system-wide on Linux), into the ring. Readers in the parent use
+    the buffer's views exactly as with an in-process buffer, without copying.
+    A plain subprocess is used rather than ``multiprocessing.Process`` so the parent's main
+    script is not re-imported in the child. ``dedup = False`` turns off the re-delivery check of
+    lowstate samples in the child (see LowStateBuffer).
+    '''
+    def __init__(self, kind, topic, num_motors, num_slots = 16, domain_id = 0, network_interface = None, dedup = True):
+        buffer_cls = STREAM_KINDS[kind][0]
+        self.shm_name = f"unitree_{kind}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self.buffer = buffer_cls(num_motors, num_slots, shm_name = self.shm_name, create = True)
+
+        cmd = [sys.executable, "-m", "shm_ingest", kind, topic, self.shm_name,
+               "--num-motors", str(num_motors), "--num-slots", str(num_slots),
+               "--domain-id", str(domain_id), "--parent-pid", str(os.getpid())]
+        if network_interface is not None:
+            cmd += ["--network-interface", network_interface]
+        if not dedup:
+            cmd += ["--no-dedup"]
+        self.process = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+        atexit.register(self.stop)
+        logger_mp.info(f"[IngestProcess] {kind} ingestion on {topic} running in pid {self.process.pid}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=1.0)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        try:
+            self.buffer.close(unlink = True)
+        except (BufferError, FileNotFoundError):
+            pass  # numpy views still exported at interpreter exit, the mapping goes away with the process
+
+
+def _run_child(args):
+    from multiprocessing import resource_tracker
+    from importlib import import_module
+    from unitree_sdk2py.core.channel import ChannelSubscriber, ChannelFactoryInitialize
+
+    buffer_cls, module, type_name = STREAM_KINDS[args.kind]
+    options = {} if args.dedup else {"dedup": False}
+    buffer = buffer_cls(args.num_motors, args.num_slots, shm_name = args.shm_name, **options)
+    # the parent owns the segment; keep this process's resource tracker from unlinking it on exit
+    resource_tracker.unregister(buffer.shm._name, "shared_memory")
+
+    if args.network_interface is None:
+        ChannelFactoryInitialize(args.domain_id)
+    else:
+        ChannelFactoryInitialize(args.domain_id, args.network_interface)
+    subscriber = ChannelSubscriber(args.topic, getattr(import_module(module), type_name))
+    subscriber.Init(buffer.write)
+
+    # exit together with the parent
+    while os.getppid() == args.parent_pid:
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Child process of IngestProcess: DDS subscriber writing into shared memory.")
+    parser.add_argument("kind", choices=sorted(STREAM_KINDS))
+    parser.add_argument("topic")
+    parser.add_argument("shm_name")
+    parser.add_argument("--num-motors", type=int, required=True)
+    parser.add_argument("--num-slots", type=int, required=True)
+    parser.add_argument("--domain-id", type=int, default=0)
+    parser.add_argument("--network-interface", default=None)
+    parser.add_argument("--parent-pid", type=int, required=True)
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false",
+                        help="publish lowstate samples that repeat the latest tick, crc and q")
+    _run_child(parser.parse_args())
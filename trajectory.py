@@ -0,0 +1,239 @@
+from collections import deque
+import numpy as np
+
+import logging_mp
+logger_mp = logging_mp.get_logger(__name__)
+
+INTERPOLATIONS = ("cubic", "quintic")
+
+
+class ArmTrajectory:
+    '''Queue of time-stamped joint waypoints, interpolated by the control thread at every tick.
+
+    Producers call ``push`` (any thread) with waypoint times on the ``time.monotonic()`` clock,
+    positions and optional velocities and feedforward torques; segments are handed over through
+    a deque and merged by the sampling thread only, so ``sample`` never blocks on a producer.
+
+    A merged segment starts from the state being commanded at the moment it is picked up, keeps
+    the already queued waypoints that come before its first time and replaces everything after,
+    so successive plans from a 30-100 Hz planner join without jumps. Positions are interpolated
+    with cubic (position/velocity) or quintic (position/velocity/acceleration) Hermite splines;
+    missing velocities and accelerations are estimated from neighbouring waypoints and are zero
+    at the final one. Torques are interpolated linearly. After the last waypoint the final
+    position is held until ``cancel`` or a new segment.
+    '''
+    def __init__(self, num_joints):
+        self.num_joints = num_joints
+        self.active = False
+        self._pending = deque()
+        self._index = 0
+
+        self.t = np.zeros(0)
+        self.q = np.zeros((0, num_joints))
+        self.dq = np.zeros((0, num_joints))
+        self.ddq = np.zeros((0, num_joints))
+        self.tau = np.zeros((0, num_joints))
+        self.quintic = np.zeros(0, dtype=bool)  # interpolation of the interval ending at each waypoint
+
+        # last sampled command, the starting state of the next merged segment
+        self.q_out = np.zeros(num_joints)
+        self.dq_out = np.zeros(num_joints)
+        self.ddq_out = np.zeros(num_joints)
+        self.tau_out = np.zeros(num_joints)
+        self._coeffs = np.zeros((0, 6, num_joints))
+        self._powers = np.zeros(6)
+
+    def push(self, times, q, dq = None, tau = None, interpolation = "cubic"):
+        '''Queue waypoints ``q[i]`` (shape ``(n, num_joints)``) to be reached at monotonic ``times[i]``.'''
+        assert interpolation in INTERPOLATIONS, f"interpolation must be one of {INTERPOLATIONS}"
+        times = np.array(times, dtype=np.float64).reshape(-1)
+        shape = (len(times), self.num_joints)
+        q = np.array(q, dtype=np.float64).reshape(shape)
+        dq = None if dq is None else np.array(dq, dtype=np.float64).reshape(shape)
+        tau = np.zeros(shape) if tau is None else np.array(tau, dtype=np.float64).reshape(shape)
+        if len(times) == 0:
+            return
+        if np.any(np.diff(times) <= 0):
+            raise ValueError("trajectory times must be strictly increasing")
+        self._pending.append((times, q, dq, tau, interpolation == "quintic"))
+
+    def cancel(self):
+        '''Stop following the trajectory from the next control tick on.'''
+        if self.active or self._pending:
+            self._pending.append(None)
+
+    def _merge(self, now, segment, q_now, dq_now, tau_now):
+        if segment is None:
+            self.active = False
+            self.t = self.t[:0]
+            return
+        times, q, dq, tau, quintic = segment
+        if not self.active:
+            self.q_out[:] = q_now
+            self.dq_out[:] = dq_now
+            self.ddq_out[:] = 0.0
+            self.tau_out[:] = tau_now
+
+        # current command, queued waypoints between now and the new segment, then the new future waypoints
+        keep = (self.t > now) & (self.t < times[0])
+        future = times > now
+        if not np.any(future):
+            logger_mp.warning("[ArmTrajectory] segment ends in the past, holding its last waypoint")
+            future[-1] = True
+            times = times.copy()
+            times[-1] = now + 1e-3
+        n_new = int(np.count_nonzero(future))
+        self.t = np.concatenate(([now], self.t[keep], times[future]))
+        self.q = np.concatenate((self.q_out[None], self.q[keep], q[future]))
+        self.tau = np.concatenate((self.tau_out[None], self.tau[keep], tau[future]))
+        self.quintic = np.concatenate(([False], self.quintic[keep], np.full(n_new, quintic)))
+
+        # velocities: given ones kept, others estimated from the neighbours (zero at the end)
+        given = np.zeros(len(self.t), dtype=bool)
+        given[0] = True
+        given[1:1 + np.count_nonzero(keep)] = True
+        velocities = np.concatenate((self.dq_out[None], self.dq[keep], np.zeros((n_new, self.num_joints))))
+        if dq is not None:
+            velocities[-n_new:] = dq[future]
+            given[-n_new:] = True
+        self.dq = self._estimate(velocities, self.q, given)
+        self.ddq = np.concatenate((self.ddq_out[None], np.zeros((len(self.t) - 1, self.num_joints))))
+        self.ddq = self._estimate(self.ddq, self.dq, np.arange(len(self.t)) == 0)
+        self._coeffs = self._fit()
+        self._index = 0
+        self.active = True
+
+    def _estimate(self, values, of, given):
+        '''Fill the rows of ``values`` not marked ``given`` with central differences of ``of`` over ``self.t``.'''
+        t = self.t
+        for i in np.flatnonzero(~given):
+            if i == len(t) - 1:
+                values[i] = 0.0
+            else:
+                values[i] = (of[i + 1] - of[i - 1]) / (t[i + 1] - t[i - 1])
+        return values
+
+    def sample(self, now, q_now, dq_now, tau_now):
+        '''Advance to ``now`` and fill ``q_out``/``dq_out``/``tau_out``; returns False when no trajectory is active.
+
+        ``q_now``, ``dq_now`` and ``tau_now`` are the command currently being sent, used as the
+        starting state when a segment arrives while no trajectory is active.'''
+        if self._pending:
+            if self.active:
+                self._evaluate(now)  # the new segment starts from where the current one is right now
+            while self._pending:
+                self._merge(now, self._pending.popleft(), q_now, dq_now, tau_now)
+        if not self.active:
+            return False
+        self._evaluate(now)
+        return True
+
+    def _evaluate(self, now):
+        t = self.t
+        last = len(t) - 1
+        i = self._index
+        while i < last and t[i + 1] <= now:
+            i += 1
+        self._index = i
+        if i == last:
+            self.q_out[:] = self.q[last]
+            self.dq_out[:] = 0.0
+            self.ddq_out[:] = 0.0
+            self.tau_out[:] = self.tau[last]
+            return
+
+        h = float(t[i + 1] - t[i])
+        s = float(now - t[i]) / h
+        s2, s3, s4 = s * s, s * s * s, s * s * s * s
+        powers = self._powers
+        powers[:] = (1.0, s, s2, s3, s4, s4 * s)
+        np.dot(powers, self._coeffs[i], out=self.q_out)
+        powers[:] = (0.0, 1.0 / h, 2.0 * s / h, 3.0 * s2 / h, 4.0 * s3 / h, 5.0 * s4 / h)
+        np.dot(powers, self._coeffs[i], out=self.dq_out)
+        h2 = h * h
+        powers[:] = (0.0, 0.0, 2.0 / h2, 6.0 * s / h2, 12.0 * s2 / h2, 20.0 * s3 / h2)
+        np.dot(powers, self._coeffs[i], out=self.ddq_out)
+        np.multiply(self.tau[i], 1.0 - s, out=self.tau_out)
+        self.tau_out += s * self.tau[i + 1]
+
+    def _fit(self):
+        '''Per-interval polynomial coefficients in the normalised time ``s``, shape ``(intervals, 6, joints)``.'''
+        h = np.diff(self.t)[:, None, None]
+        p0, p1 = self.q[:-1, None], self.q[1:, None]
+        v0, v1 = h * self.dq[:-1, None], h * self.dq[1:, None]
+        a0, a1 = h * h * self.ddq[:-1, None], h * h * self.ddq[1:, None]
+        quintic = np.stack((p0, v0, a0, a1, v1, p1), axis=1)[..., 0, :]
+        cubic = np.stack((p0, v0, p1, v1), axis=1)[..., 0, :]
+        coeffs = np.einsum("bk,ibj->ikj", _CUBIC_BASIS, cubic)
+        mask = self.quintic[1:]
+        if np.any(mask):
+            coeffs[mask] = np.einsum("bk,ibj->ikj", _QUINTIC_BASIS, quintic[mask])
+        return coeffs
+
+
+# monomial coefficients (s^0 .. s^5) of the Hermite basis functions
+_CUBIC_BASIS = np.array([
+    [1, 0, -3, 2, 0, 0],    # p0
+    [0, 1, -2, 1, 0, 0],    # h * v0
+    [0, 0, 3, -2, 0, 0],    # p1
+    [0, 0, -1, 1, 0, 0],    # h * v1
+], dtype=np.float64)
+_QUINTIC_BASIS = np.array([
+    [1, 0, 0, -10, 15, -6],         # p0
+    [0, 1, 0, -6, 8, -3],           # h * v0
+    [0, 0, 0.5, -1.5, 1.5, -0.5],   # h^2 * a0
+    [0, 0, 0, 0.5, -1, 0.5],        # h^2 * a1
+    [0, 0, 0, -4, 7, -3],           # h * v1
+    [0, 0, 0, 10, -15, 6],          # p1
+], dtype=np.float64)
+
+
+def check_continuity(max_step = 0.01, max_velocity_error = 0.1, max_final_error = 1e-6):
+    '''Sample an overlapping 30 Hz waypoint stream at 250 Hz; return a list of failures (empty when fine).
+
+    For every interpolation the largest position change per sample must stay below ``max_step``
+    rad, the finite-difference velocity must match ``dq_out`` within ``max_velocity_error`` rad/s
+    and the last sample must end on the last waypoint within ``max_final_error`` rad.'''
+    import time
+    dt = 1.0 / 250.0
+    failures = []
+    for interpolation in INTERPOLATIONS:
+        trajectory = ArmTrajectory(2)
+        zeros = np.zeros(2)
+        times = np.arange(1, 31) / 30.0
+        waypoints = np.stack([np.sin(times), np.cos(times) - 1.0], axis=1)
+        trajectory.push(times[:15], waypoints[:15], interpolation = interpolation)
+        qs, dqs = [], []
+        cost = 0
+        for k in range(int(1.2 / dt)):
+            now = k * dt
+            if k == int(0.3 / dt):  # next plan arrives mid-way and overlaps the queued one
+                trajectory.push(times[10:], waypoints[10:], interpolation = interpolation)
+            start = time.perf_counter_ns()
+            trajectory.sample(now, zeros, zeros, zeros)
+            cost += time.perf_counter_ns() - start
+            qs.append(trajectory.q_out.copy())
+            dqs.append(trajectory.dq_out.copy())
+        qs, dqs = np.array(qs), np.array(dqs)
+        step = np.abs(np.diff(qs, axis=0)).max()
+        velocity_error = np.abs(np.diff(qs, axis=0) / dt - 0.5 * (dqs[1:] + dqs[:-1])).max()
+        final_error = np.abs(qs[-1] - waypoints[-1]).max()
+        print(f"{interpolation}: max step {step:.4f} rad, velocity consistency {velocity_error:.4f} rad/s, "
+              f"final error {final_error:.2e} rad, {cost / len(qs) / 1e3:.1f} us per sample")
+        if step > max_step:
+            failures.append(f"{interpolation}: max step {step:.4f} rad above {max_step} rad")
+        if velocity_error > max_velocity_error:
+            failures.append(f"{interpolation}: velocity error {velocity_error:.4f} rad/s above {max_velocity_error} rad/s")
+        if final_error > max_final_error:
+            failures.append(f"{interpolation}: final error {final_error:.2e} rad above {max_final_error} rad")
+    return failures
+
+
+if __name__ == "__main__":
+    # Continuity of position and velocity across overlapping plans; exit 1 when a threshold is exceeded.
+    import sys
+
+    failures = check_continuity()
+    for failure in failures:
+        print(f"ArmTrajectory: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
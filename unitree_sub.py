@@ -1,59 +1,125 @@
-from vuer import Vuer
-import asyncio
-import time
-from vuer.schemas import DefaultScene, Urdf, OrbitControls
-from robot_control import G1_29_ArmController
-from robot_hand_inspire import Inspire_Controller_DFX
-from unitree_sdk2py.core.channel import ChannelFactoryInitialize
-import numpy as np
-import utils
-import pinocchio
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
-from utils import urdf_movable_joint_names, all_joint_positions
-
-URDF_PATH = "g1.urdf"
-URDF_URL = "https://raw.githubusercontent.com/unitreerobotics/unitree_ros/refs/heads/master/robots/g1_description/g1_29dof_rev_1_0_with_inspire_hand_DFQ.urdf"
+import logging_mp
+logging_mp.basic_config(level = logging_mp.INFO)  # the startup report and controller progress are logged at INFO
 
+from instrumentation import PhaseTimer
+startup = PhaseTimer("unitree_sub")
 
-ChannelFactoryInitialize(1)
+with startup.phase("import_controllers"):
+    from robot_control import G1_29_ArmController, G1_29_JointIndex, G1_29_JointArmIndex, URDF_JOINT_MAP as ARM_URDF_JOINT_MAP
+    from robot_hand_inspire import Inspire_Controller_DFX
+    from unitree_sdk2py.core.channel import ChannelFactoryInitialize
+    import utils
+    from robot_assets import ModelCache, ASSET_DIR, local_urdf
 
-robot_control = G1_29_ArmController(motion_mode = True,simulation_mode = True)
-robot_hand = Inspire_Controller_DFX()
-robot_model = pinocchio.buildModelFromUrdf(URDF_PATH, mimic = True)
+URDF_PATH = "g1.urdf"
+URDF_URL = "https://raw.githubusercontent.com/unitreerobotics/unitree_ros/refs/heads/master/robots/g1_description/g1_29dof_rev_1_0_with_inspire_hand_DFQ.urdf"
+ROBOT_POSITION = [0.0, 1.5, -1.2]   # move robot instead of VR camera (tune axes)
+
+DDS_DOMAIN_ID = 1  # 0 for real robot, 1 for simulation
+
+# one entry per robot shown and controlled by this process: scene key, position, DDS topic
+# prefix and, optionally, the DDS domain its state is ingested from in a child process.
+# topic_prefix (e.g. "g1_a/") is prepended to every topic of the robot's controllers, so several
+# robots can share one domain. ingest_domain_id must be DDS_DOMAIN_ID: commands are published
+# from this process, which joins a single domain
+ROBOTS = [
+    dict(key = "robot", position = ROBOT_POSITION, topic_prefix = "", ingest_domain_id = None),
+]
+
+# joint streaming: only joints that moved more than STREAM_EPSILON rad are sent, at up to
+# STREAM_MAX_RATE Hz while moving, backing off to STREAM_MIN_RATE Hz when the robot is still
+STREAM_EPSILON = 1e-3
+STREAM_MIN_RATE = 2.0
+STREAM_MAX_RATE = 30.0
+# "dict" works with the stock Vuer client. "float32" / "int16" need the handler in
+# client/joint_state.js and also carry capture times and arm velocities, so the headset
+# interpolates between updates: STREAM_MAX_RATE can then drop to 10-20 Hz
+WIRE_FORMAT = "dict"
+
+
+ChannelFactoryInitialize(DDS_DOMAIN_ID)
+
+def timed_init(name, fn, *args, **kwargs):
+    with startup.phase(name):
+        return fn(*args, **kwargs)
+
+# the controllers mostly wait for their first DDS sample: bring them all up side by side and
+# import the web stack and load the model meanwhile
+executor = ThreadPoolExecutor(max_workers = 2 * len(ROBOTS))
+controller_futures = []
+for robot in ROBOTS:
+    options = dict(event_driven = True, topic_prefix = robot["topic_prefix"], ingest_domain_id = robot["ingest_domain_id"])
+    arm_future = executor.submit(timed_init, f"{robot['key']}_arm_controller", G1_29_ArmController,
+                                 motion_mode = True, simulation_mode = True, domain_id = DDS_DOMAIN_ID, **options)
+    hand_future = executor.submit(timed_init, f"{robot['key']}_hand_controller", Inspire_Controller_DFX, **options)
+    controller_futures.append((robot, arm_future, hand_future))
+
+with startup.phase("import_vuer"):
+    from vuer import Vuer
+    from vuer.schemas import DefaultScene, OrbitControls
+    from scene_stream import SceneBroadcaster
+    from async_bridge import StateNotifier
+
+with startup.phase("joint_tables"):
+    # joint map and mimic tables cached by URDF hash, so pinocchio is not even imported on a hit
+    joint_tables = ModelCache().tables(URDF_PATH)
+
+# serve the robot description from this app once it has been mirrored (fetched in the background otherwise)
+urdf_rel = local_urdf(URDF_URL)
 
 key_path = pathlib.Path(__file__).parent / "key.pem"
 cert_path = pathlib.Path(__file__).parent / "cert.pem"
-app = Vuer(host = "0.0.0.0", port = 8012)
+app = Vuer(host = "0.0.0.0", port = 8012, static_root = ASSET_DIR)
 app.cert = cert_path
 app.key = key_path
+urdf_src = URDF_URL if urdf_rel is None else f"{app.static_prefix}/{urdf_rel}"
 
-@app.spawn(start=True)
-async def main(sess):
-    sess.set @ DefaultScene(
-        bgChildren=[OrbitControls(key="OrbitControls")],
-        up=[0, 1, 0],
-    )
+robots = [(robot, arm_future.result(), hand_future.result()) for robot, arm_future, hand_future in controller_futures]
+executor.shutdown()
+
+# one joint map for every robot: each stream consumes the mapper's output buffer (and the
+# broadcaster copies the velocities) before the next robot is mapped
+arm_joint_names = [ARM_URDF_JOINT_MAP.get(id.name) for id in G1_29_JointIndex]
+joint_mapper = utils.JointMapper(joint_tables, [arm_joint_names, robots[0][2].state_names])
+# velocities are only measured for the arms (hand joints are sent as still)
+velocity_mapper = utils.JointMapper(joint_tables, [[ARM_URDF_JOINT_MAP.get(id.name) for id in G1_29_JointArmIndex]])
 
 
-    while True:
+def robot_joint_values(robot_control, robot_hand):
+    hand_state = np.zeros(len(robot_hand.state_names))
+    return lambda: joint_mapper(robot_control.get_current_motor_q(view = True), robot_hand.get_state_array(hand_state))
 
-        robot_state = robot_control.get_motor_states()
-        hand_state = robot_hand.get_state()
 
-        state = {**robot_state, **hand_state}
+def robot_joint_velocities(robot_control):
+    return lambda: velocity_mapper.velocities(robot_control.get_current_dual_arm_dq(view = True))
 
-        q = pinocchio.neutral(robot_model)
-        q =utils.set_q_from_joint_dict(robot_model, q,  state)
 
-        jointvals = all_joint_positions(robot_model, q)
+def robot_state_stamp(robot_control):
+    buffer = robot_control.lowstate_buffer
+    return lambda: float(buffer.stamp[buffer.latest_slot()])
 
 
-        sess.upsert @ Urdf(
-            src=URDF_URL,
-            jointValues=jointvals,
-            key = "robot",
-            position=[0.0, 1.5, -1.2],   # move robot instead of VR camera (tune axes)
-        )
+# one producer computes and serializes every update of every robot, shared by all connected
+# viewers; it wakes up when new state arrives instead of polling the controllers
+state_notifier = StateNotifier(*[buffer for _, robot_control, robot_hand in robots
+                                 for buffer in (robot_control.lowstate_buffer, *robot_hand.state_buffers)])
+broadcaster = SceneBroadcaster(app, notifier = state_notifier, wire_format = WIRE_FORMAT)
+for robot, robot_control, robot_hand in robots:
+    broadcaster.add_urdf(robot["key"], urdf_src, robot["position"], robot_joint_values(robot_control, robot_hand),
+                         joint_mapper.names, stamp = robot_state_stamp(robot_control),
+                         produce_velocity = robot_joint_velocities(robot_control),
+                         epsilon = STREAM_EPSILON, min_rate = STREAM_MIN_RATE, max_rate = STREAM_MAX_RATE)
+startup.report()
+
+@app.spawn(start=True)
+async def main(sess):
+    sess.set @ DefaultScene(
+        bgChildren=[OrbitControls(key="OrbitControls")],
+        up=[0, 1, 0],
+    )
 
-        await asyncio.sleep(0.1)
+    await broadcaster.serve(sess)
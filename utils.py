@@ -1,6 +1,11 @@
-import pinocchio as pin
+from __future__ import annotations
+
 import numpy as np
 import xml.etree.ElementTree as ET
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # only the type hints need pinocchio; importing it costs a noticeable part of startup
+    import pinocchio as pin
 
 def urdf_movable_joint_names(path: str) -> list[str]:
     root = ET.parse(path).getroot()
@@ -59,3 +64,120 @@ def set_q_from_joint_dict(model: pin.Model, q: np.ndarray, joint_dict: dict[str,
         if nq == 1:
             q[idx_q] = val
     return q
+
+
+class JointTables:
+    """
+    The joint layout of a model that JointMapper needs, as plain arrays.
+
+    ``joint_idx_q`` maps every 1-DoF joint name to its index in q, ``names`` / ``idx_q`` list
+    those joints in model order, and the ``mimic_*`` arrays describe each mimic joint as
+    s*q[ref] + o. Tables can be saved to and loaded from ``.npz`` without pinocchio.
+    """
+    def __init__(self, nq, neutral, names, idx_q, mimic_names, mimic_ref_idx_q, mimic_scaling, mimic_offset):
+        self.nq = int(nq)
+        self.neutral = np.asarray(neutral, dtype=np.float64)
+        self.names = list(names)
+        self.idx_q = np.asarray(idx_q, dtype=np.intp)
+        self.joint_idx_q = dict(zip(self.names, self.idx_q.tolist()))
+        self.mimic_names = list(mimic_names)
+        self.mimic_ref_idx_q = np.asarray(mimic_ref_idx_q, dtype=np.intp)
+        self.mimic_scaling = np.asarray(mimic_scaling, dtype=np.float64)
+        self.mimic_offset = np.asarray(mimic_offset, dtype=np.float64)
+
+    @classmethod
+    def from_model(cls, model: pin.Model) -> JointTables:
+        import pinocchio as pin
+        names, idx_q = [], []
+        for jid in range(1, model.njoints):
+            if model.nqs[jid] == 1:
+                names.append(model.names[jid])
+                idx_q.append(model.idx_qs[jid])
+
+        mimic_names, mimic_ref_idx_q, scaling, offset = [], [], [], []
+        for mim_jid, ref_jid in zip(model.mimicking_joints, model.mimicked_joints):
+            jm = model.joints[mim_jid].extract()
+            mimic_names.append(model.names[mim_jid])
+            mimic_ref_idx_q.append(model.idx_qs[ref_jid])
+            scaling.append(jm.scaling)
+            offset.append(jm.offset)
+        return cls(model.nq, pin.neutral(model), names, idx_q, mimic_names, mimic_ref_idx_q, scaling, offset)
+
+    def save(self, path: str):
+        np.savez(path, nq=self.nq, neutral=self.neutral, names=np.array(self.names, dtype=str), idx_q=self.idx_q,
+                 mimic_names=np.array(self.mimic_names, dtype=str), mimic_ref_idx_q=self.mimic_ref_idx_q,
+                 mimic_scaling=self.mimic_scaling, mimic_offset=self.mimic_offset)
+
+    @classmethod
+    def load(cls, path: str) -> JointTables:
+        with np.load(path) as data:
+            return cls(data["nq"], data["neutral"], data["names"].tolist(), data["idx_q"], data["mimic_names"].tolist(),
+                       data["mimic_ref_idx_q"], data["mimic_scaling"], data["mimic_offset"])
+
+
+class JointMapper:
+    """
+    Precompiled mapping from raw controller arrays to the full URDF joint vector.
+
+    Built once from the model (or its JointTables) and, per source array, the URDF joint name
+    of each entry (None or unknown names are ignored). Calling the mapper scatters the sources
+    into q, gathers the 1-DoF joints and evaluates every mimic joint as s*q_ref + o, all with
+    index arrays into preallocated buffers. The output order is ``names``, which matches
+    the key order of ``all_joint_positions``.
+    """
+    def __init__(self, model: pin.Model | JointTables, sources: list[list[str]]):
+        tables = model if isinstance(model, JointTables) else JointTables.from_model(model)
+        self.q = tables.neutral.copy()
+
+        self.src_idx = []
+        self.dst_idx_q = []
+        for joint_names in sources:
+            src, dst = [], []
+            for i, name in enumerate(joint_names):
+                idx_q = tables.joint_idx_q.get(name)
+                if idx_q is not None:
+                    src.append(i)
+                    dst.append(idx_q)
+            self.src_idx.append(np.array(src, dtype=np.intp))
+            self.dst_idx_q.append(np.array(dst, dtype=np.intp))
+
+        self.num_actuated = len(tables.names)
+        self.idx_q = tables.idx_q
+        self.mimic_ref_idx_q = tables.mimic_ref_idx_q
+        self.mimic_scaling = tables.mimic_scaling
+        self.mimic_offset = tables.mimic_offset
+
+        self.names = tables.names + tables.mimic_names
+        self.values = np.zeros(len(self.names))
+        self.dq = np.zeros_like(self.q)
+        self.velocity_values = np.zeros(len(self.names))
+
+    def __call__(self, *arrays: np.ndarray) -> np.ndarray:
+        """Map one array per source into ``self.values`` (reused between calls) and return it."""
+        q = self.q
+        for array, src, dst in zip(arrays, self.src_idx, self.dst_idx_q):
+            q[dst] = array[src]
+        values = self.values
+        np.take(q, self.idx_q, out=values[:self.num_actuated])
+        mimic = values[self.num_actuated:]
+        np.take(q, self.mimic_ref_idx_q, out=mimic)
+        mimic *= self.mimic_scaling
+        mimic += self.mimic_offset
+        return values
+
+    def velocities(self, *arrays: np.ndarray) -> np.ndarray:
+        """Map joint velocities like ``__call__`` maps positions (mimic joints get s*dq_ref) into ``self.velocity_values``.
+
+        Joints of sources that are not passed, or have no velocity, stay at zero."""
+        dq = self.dq
+        for array, src, dst in zip(arrays, self.src_idx, self.dst_idx_q):
+            dq[dst] = array[src]
+        values = self.velocity_values
+        np.take(dq, self.idx_q, out=values[:self.num_actuated])
+        mimic = values[self.num_actuated:]
+        np.take(dq, self.mimic_ref_idx_q, out=mimic)
+        mimic *= self.mimic_scaling
+        return values
+
+    def as_dict(self, values: np.ndarray) -> dict[str, float]:
+        return dict(zip(self.names, values.tolist()))